@@ -15,12 +15,7 @@ GNU General Public License for more details.
 
 
 '''
-import wave
 import struct
-import sys
-import audioop
-import binascii
-from byteutils import *
 
 
 _indexAdjust = [ -1, -1, -1, -1, 2, 4, 6, 8 ]
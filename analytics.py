@@ -0,0 +1,355 @@
+#!/usr/bin/env python
+'''
+analytics.py Batch analysis of recorded Brookstone Rover 2.0 sessions on all
+cores.
+
+Each recording is split into shards on record boundaries, the shards are
+analyzed in parallel by a process pool, streaming their packets from disk, and
+the per-shard results are merged in order.  For each session it reports:
+
+  - per-second video frame counts and sizes
+  - per-second audio loudness (RMS and peak)
+  - gaps in the video longer than a threshold
+  - optionally, one JPEG frame saved every so many seconds
+
+Usage: analytics.py [-j PROCESSES] [--gap SEC] [--samples DIR] [--every SEC]
+                    [--json PATH] [--headers-only] RECORDING ...
+
+With --headers-only, per-second video frame counts and sizes and video gaps
+come from the packet headers alone, decoded in bulk with NumPy.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+'''
+
+import argparse
+import json
+import math
+import multiprocessing
+import os
+
+from mediaparser import VIDEO, AUDIO, video_frame, audio_frame
+from recording import read_packets, shard_recording
+
+# Use NumPy, where available, to sum audio blocks
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class SessionStats:
+    ''' Mergeable statistics for a stretch of a recording.  Per-second figures
+        are keyed by whole seconds of receive time.
+    '''
+
+    def __init__(self, gapSec=0.5, sampleDir=None, sampleSec=10, name='session'):
+
+        self.gapSec = gapSec
+        self.sampleDir = sampleDir
+        self.sampleSec = sampleSec
+        self.name = name
+
+        self.firstTime = None
+        self.lastTime = None
+        self.firstVideo = None
+        self.lastVideo = None
+
+        self.videoFrames = 0
+        self.audioBlocks = 0
+
+        # second -> [video frames, video bytes, audio samples, sum of squares, peak]
+        self.seconds = {}
+
+        # (start time, length) of each gap in the video
+        self.gaps = []
+
+        # sample period number -> (receive time, path of saved JPEG)
+        self.samples = {}
+
+    def addVideo(self, recvTime, jpegbytes):
+
+        self._addTime(recvTime)
+
+        if self.lastVideo is not None and recvTime - self.lastVideo > self.gapSec:
+            self.gaps.append((self.lastVideo, recvTime - self.lastVideo))
+
+        if self.firstVideo is None:
+            self.firstVideo = recvTime
+        self.lastVideo = recvTime
+
+        self.videoFrames += 1
+
+        second = self._second(recvTime)
+        second[0] += 1
+        second[1] += len(jpegbytes)
+
+        if self.sampleDir:
+            period = int(recvTime // self.sampleSec)
+            if period not in self.samples:
+                path = os.path.join(self.sampleDir, '%s-%012.3f.jpg' % (self.name, recvTime))
+                f = open(path, 'wb')
+                f.write(jpegbytes)
+                f.close()
+                self.samples[period] = (recvTime, path)
+
+    def addAudio(self, recvTime, pcmsamples):
+
+        self._addTime(recvTime)
+
+        self.audioBlocks += 1
+
+        if np is not None:
+            samples = np.asarray(pcmsamples, dtype=np.int64)
+            squares = int(np.dot(samples, samples))
+            peak = int(np.abs(samples).max()) if len(samples) else 0
+
+        # Else both in one pass over the block
+        else:
+            squares = 0
+            peak = 0
+            for sample in pcmsamples:
+                squares += sample*sample
+                if sample > peak:
+                    peak = sample
+                elif -sample > peak:
+                    peak = -sample
+
+        second = self._second(recvTime)
+        second[2] += len(pcmsamples)
+        second[3] += squares
+        second[4] = max(second[4], peak)
+
+    def merge(self, other):
+        ''' Adds in the statistics of the stretch that follows this one.
+        '''
+
+        if other.firstTime is None:
+            return
+
+        if self.firstTime is None:
+            self.firstTime = other.firstTime
+        self.lastTime = other.lastTime
+
+        # A gap may straddle the shard boundary
+        if self.lastVideo is not None and other.firstVideo is not None and \
+           other.firstVideo - self.lastVideo > self.gapSec:
+            self.gaps.append((self.lastVideo, other.firstVideo - self.lastVideo))
+
+        if self.firstVideo is None:
+            self.firstVideo = other.firstVideo
+        if other.lastVideo is not None:
+            self.lastVideo = other.lastVideo
+
+        self.videoFrames += other.videoFrames
+        self.audioBlocks += other.audioBlocks
+        self.gaps.extend(other.gaps)
+
+        for t, counts in other.seconds.items():
+            second = self.seconds.get(t)
+            if second is None:
+                self.seconds[t] = list(counts)
+            else:
+                for k in range(4):
+                    second[k] += counts[k]
+                second[4] = max(second[4], counts[4])
+
+        # Both shards may have sampled the same period; keep the earlier frame
+        for period, sample in other.samples.items():
+            if period in self.samples:
+                os.remove(sample[1])
+            else:
+                self.samples[period] = sample
+
+    def summary(self):
+        ''' Returns a dictionary of results, with times in seconds from the
+            start of the stretch.
+        '''
+
+        if self.firstTime is None:
+            return {'name' : self.name, 'duration' : 0}
+
+        start = int(self.firstTime)
+        duration = self.lastTime - self.firstTime
+
+        perSecond = []
+
+        for t in sorted(self.seconds):
+            frames, nbytes, nsamples, squares, peak = self.seconds[t]
+            perSecond.append({'second' : t - start,
+                              'videoFrames' : frames,
+                              'videoBytes' : nbytes,
+                              'audioRms' : math.sqrt(float(squares) / nsamples) if nsamples else 0.,
+                              'audioPeak' : peak})
+
+        return {'name' : self.name,
+                'duration' : duration,
+                'videoFrames' : self.videoFrames,
+                'audioBlocks' : self.audioBlocks,
+                'fps' : self.videoFrames / duration if duration else 0.,
+                'gaps' : [(t - self.firstTime, length) for t, length in self.gaps],
+                'samples' : [path for t, path in sorted(self.samples.values())],
+                'perSecond' : perSecond}
+
+    def _addTime(self, recvTime):
+
+        if self.firstTime is None:
+            self.firstTime = recvTime
+        self.lastTime = recvTime
+
+    def _second(self, recvTime):
+
+        t = int(recvTime)
+
+        second = self.seconds.get(t)
+
+        if second is None:
+            second = self.seconds[t] = [0, 0, 0, 0, 0]
+
+        return second
+
+
+def analyze_shard(task):
+    '''
+    Analyzes the packets of one shard, given as a (path, start, end, options)
+    task, and returns its SessionStats.  Runs in a pool worker.
+    '''
+
+    path, start, end, options = task
+
+    stats = SessionStats(options['gapSec'], options['sampleDir'], options['sampleSec'], \
+                         os.path.splitext(os.path.basename(path))[0])
+
+    for recvTime, packet in read_packets(path, start, end):
+
+        # Records hold the MO_V marker; frames are cut from after it
+        pack = packet[4:]
+        op = ord(pack[0])
+
+        if op == VIDEO:
+            stats.addVideo(recvTime, video_frame(pack, recvTime).jpegbytes)
+
+        elif op == AUDIO:
+            stats.addAudio(recvTime, audio_frame(pack, recvTime).pcmsamples)
+
+    return stats
+
+
+def analyze(paths, processes=None, shardBytes=16777216, gapSec=0.5, sampleDir=None, \
+    sampleSec=10):
+    '''
+    Analyzes the recordings at paths on a pool of processes (default: one per
+    core), in shards of about shardBytes, and returns a list of per-recording
+    summaries.  Gaps in the video longer than gapSec are reported; if sampleDir
+    is given, a JPEG frame is saved there every sampleSec seconds.
+    '''
+
+    options = {'gapSec' : gapSec, 'sampleDir' : sampleDir, 'sampleSec' : sampleSec}
+
+    tasks = []
+    for path in paths:
+        for start, end in shard_recording(path, shardBytes):
+            tasks.append((path, start, end, options))
+
+    pool = multiprocessing.Pool(processes)
+
+    merged = {}
+
+    try:
+        # Results come back in task order, so shards merge front to back
+        for task, stats in zip(tasks, pool.imap(analyze_shard, tasks)):
+            if task[0] in merged:
+                merged[task[0]].merge(stats)
+            else:
+                merged[task[0]] = stats
+
+    finally:
+        pool.close()
+        pool.join()
+
+    return [merged[path].summary() for path in paths if path in merged]
+
+
+def analyze_headers(path, gapSec=0.5):
+    '''
+    Returns a summary of the recording at path like analyze()'s, without
+    audio loudness or samples, from its packet headers alone.  Nothing is
+    decoded, so this needs no pool to keep up with the disk.  Needs NumPy.
+    '''
+
+    import numpy as np
+
+    from headers import read_headers
+
+    headers = read_headers(path)
+
+    name = os.path.splitext(os.path.basename(path))[0]
+
+    if not headers.packets():
+        return {'name' : name, 'duration' : 0}
+
+    first = headers.recvTimes.min()
+    duration = headers.recvTimes.max() - first
+
+    times = headers.videoTimes
+    intervals = np.diff(times)
+
+    gaps = [(times[k] - first, intervals[k]) for k in np.nonzero(intervals > gapSec)[0]]
+
+    # Frames and bytes per whole second of receive time
+    seconds, index = np.unique(np.floor(times).astype(np.int64), return_inverse=True)
+    frames = np.bincount(index, minlength=len(seconds))
+    nbytes = np.bincount(index, headers.video['jpegLength'], len(seconds))
+
+    perSecond = [{'second' : int(t) - int(first),
+                  'videoFrames' : int(count),
+                  'videoBytes' : int(total)}
+                 for t, count, total in zip(seconds, frames, nbytes)]
+
+    return {'name' : name,
+            'duration' : float(duration),
+            'videoFrames' : len(times),
+            'audioBlocks' : len(headers.audioTimes),
+            'fps' : len(times) / duration if duration else 0.,
+            'gaps' : [(float(t), float(length)) for t, length in gaps],
+            'samples' : [],
+            'perSecond' : perSecond}
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Analyze recorded Rover sessions.')
+    parser.add_argument('recordings', nargs='+', metavar='RECORDING')
+    parser.add_argument('-j', '--processes', type=int, default=None, help='worker processes')
+    parser.add_argument('--shard-mb', type=float, default=16, help='shard size in MB')
+    parser.add_argument('--gap', type=float, default=0.5, help='report video gaps over this many seconds')
+    parser.add_argument('--samples', metavar='DIR', help='save sampled JPEG frames here')
+    parser.add_argument('--every', type=float, default=10, help='seconds between sampled frames')
+    parser.add_argument('--json', metavar='PATH', help='write full results as JSON')
+    parser.add_argument('--headers-only', action='store_true', \
+                        help='count frames, bytes and gaps from packet headers without decoding')
+    args = parser.parse_args()
+
+    if args.headers_only:
+        results = [analyze_headers(path, args.gap) for path in args.recordings]
+
+    else:
+        results = analyze(args.recordings, args.processes, int(args.shard_mb*1048576), \
+                          args.gap, args.samples, args.every)
+
+    for result in results:
+        print('%s: %.1f sec, %d frames (%.1f fps), %d audio blocks, %d gaps' % \
+              (result['name'], result['duration'], result.get('videoFrames', 0), \
+               result.get('fps', 0), result.get('audioBlocks', 0), len(result.get('gaps', []))))
+
+    if args.json:
+        f = open(args.json, 'w')
+        json.dump(results, f, indent=1)
+        f.close()
@@ -0,0 +1,157 @@
+'''
+audiolevel.py Streaming loudness and voice-activity detection for audio
+from the Brookstone Rover 2.0.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+'''
+
+import numpy as np
+
+from events import EventSource
+
+
+class AudioLevelDetector(EventSource):
+
+    def __init__(self, onThreshold=10000, offThreshold=None, metric='rms', \
+        history=250, vad=False, vadRatio=3.0, vadMinLevel=300, vadMaxZcr=0.5, \
+        vadHangBlocks=10):
+        ''' Creates a detector that measures each block of PCM samples passed
+            to process().  The metric ('rms', 'peak' or 'mean' absolute value,
+            in +/- 2^15) is compared against hysteresis thresholds: a 'loud'
+            event fires when it reaches onThreshold and a 'quiet' event when it
+            falls below offThreshold (default 70% of onThreshold).  The last
+            history levels are kept in a ring buffer.
+
+            With vad set, 'voice' and 'silence' events also fire when the RMS
+            level rises vadRatio times above a running noise floor (and above
+            vadMinLevel) with a zero-crossing rate under vadMaxZcr, ending after
+            vadHangBlocks blocks without voice.
+
+            Listeners added with addListener() are called back with each event
+            and the level on the thread calling process(); wait() waits for
+            'loud' by default.
+        '''
+
+        EventSource.__init__(self, ('loud', 'quiet', 'voice', 'silence'))
+
+        self.onThreshold = onThreshold
+        self.offThreshold = 0.7*onThreshold if offThreshold is None else offThreshold
+        self.metric = metric
+        self.history = history
+
+        self.vad = vad
+        self.vadRatio = vadRatio
+        self.vadMinLevel = vadMinLevel
+        self.vadMaxZcr = vadMaxZcr
+        self.vadHangBlocks = vadHangBlocks
+
+        self.isLoud = False
+        self.isVoice = False
+        self.level = 0
+        self.peak = 0
+        self.rms = 0
+        self.noiseFloor = None
+
+        self._levels = np.zeros(history, dtype=np.float32)
+        self._peaks = np.zeros(history, dtype=np.float32)
+        self._count = 0
+        self._hang = 0
+
+    def recentLevels(self):
+        ''' Returns the ring buffer of recent levels, oldest first.
+        '''
+        return self._ordered(self._levels)
+
+    def recentPeaks(self):
+        ''' Returns the ring buffer of recent peaks, oldest first.
+        '''
+        return self._ordered(self._peaks)
+
+    def process(self, pcmsamples):
+        ''' Measures a block of PCM samples and fires any resulting events.
+        '''
+
+        samples = np.asarray(pcmsamples, dtype=np.float32)
+
+        if not len(samples):
+            return
+
+        absval = np.abs(samples)
+
+        self.peak = float(absval.max())
+        self.rms = float(np.sqrt(np.dot(samples, samples) / len(samples)))
+
+        if self.metric == 'peak':
+            self.level = self.peak
+        elif self.metric == 'mean':
+            self.level = float(absval.mean())
+        else:
+            self.level = self.rms
+
+        k = self._count % self.history
+        self._levels[k] = self.level
+        self._peaks[k] = self.peak
+        self._count += 1
+
+        events = []
+
+        # Hysteresis keeps a level hovering near one threshold from chattering
+        if not self.isLoud and self.level >= self.onThreshold:
+            self.isLoud = True
+            events.append('loud')
+
+        elif self.isLoud and self.level < self.offThreshold:
+            self.isLoud = False
+            events.append('quiet')
+
+        if self.vad:
+            events.extend(self._detectVoice(samples))
+
+        if events:
+            self._fire(events, self.level)
+
+    # "Private" methods ========================================================
+
+    def _detectVoice(self, samples):
+
+        if self.noiseFloor is None:
+            self.noiseFloor = self.rms
+
+        crossings = np.count_nonzero(np.diff(np.signbit(samples)))
+        zcr = float(crossings) / len(samples)
+
+        voiced = self.rms > max(self.vadMinLevel, self.vadRatio*self.noiseFloor) \
+            and zcr < self.vadMaxZcr
+
+        # Track the noise floor only while nobody is talking
+        if not voiced:
+            self.noiseFloor = 0.95*self.noiseFloor + 0.05*self.rms
+
+        if voiced:
+            self._hang = self.vadHangBlocks
+            if not self.isVoice:
+                self.isVoice = True
+                return ['voice']
+
+        elif self.isVoice:
+            self._hang -= 1
+            if self._hang <= 0:
+                self.isVoice = False
+                return ['silence']
+
+        return []
+
+    def _ordered(self, ring):
+
+        if self._count < self.history:
+            return ring[:self._count].copy()
+
+        return np.roll(ring, -(self._count % self.history))
@@ -0,0 +1,157 @@
+'''
+audiosink.py Play PCM audio streamed from the Brookstone Rover 2.0 through an
+adaptive jitter buffer.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+'''
+
+import threading
+import collections
+
+import numpy as np
+import pyaudio
+
+
+def pcm_to_bytes(samples):
+    '''
+    Accepts a block of PCM samples (list, NumPy array or little-endian int16
+    bytes) and returns it as little-endian int16 bytes.
+    '''
+
+    if isinstance(samples, bytes):
+        return samples
+
+    return np.asarray(samples, dtype='<i2').tobytes()
+
+
+class AudioPlaybackSink:
+
+    def __init__(self, rate=8000, blockSize=320, minDepth=2, maxDepth=25, \
+        shrinkAfter=250):
+        ''' Opens a callback-mode PyAudio output stream at the specified rate.
+            Blocks passed to write() are queued and played on PortAudio's own
+            thread, so write() never blocks.  Playback starts once the queue
+            holds the target depth (in blocks); each underrun raises the target,
+            and shrinkAfter underrun-free callbacks lower it again, within
+            [minDepth, maxDepth].
+        '''
+
+        self.rate = rate
+        self.blockSize = blockSize
+        self.minDepth = minDepth
+        self.maxDepth = maxDepth
+        self.shrinkAfter = shrinkAfter
+
+        self.targetDepth = minDepth
+        self.underruns = 0
+        self.overflows = 0
+
+        self._blocks = collections.deque()
+        self._queuedBytes = 0
+        self._buffering = True
+        self._callbacksSinceUnderrun = 0
+        self._lock = threading.Lock()
+
+        self._pyaudio = pyaudio.PyAudio()
+
+        self._stream = self._pyaudio.open(format=pyaudio.paInt16,
+                                          channels=1,
+                                          rate=rate,
+                                          output=True,
+                                          frames_per_buffer=blockSize,
+                                          stream_callback=self._callback)
+
+    def write(self, samples):
+        ''' Queues a block of PCM samples for playback.
+        '''
+
+        data = pcm_to_bytes(samples)
+
+        with self._lock:
+
+            self._blocks.append(data)
+            self._queuedBytes += len(data)
+
+            # Drop the oldest audio rather than let latency grow without bound
+            while len(self._blocks) > self.maxDepth:
+                self._queuedBytes -= len(self._blocks.popleft())
+                self.overflows += 1
+
+    def depth(self):
+        ''' Returns the number of milliseconds of audio waiting to be played.
+        '''
+        return 1000. * self._queuedBytes / 2 / self.rate
+
+    def stats(self):
+        ''' Returns a dictionary of buffer depth, target depth, underruns and
+            overflows.
+        '''
+        return {'depth_ms' : self.depth(),
+                'target_blocks' : self.targetDepth,
+                'underruns' : self.underruns,
+                'overflows' : self.overflows}
+
+    def close(self):
+        ''' Stops playback and releases the audio device.
+        '''
+        self._stream.stop_stream()
+        self._stream.close()
+        self._pyaudio.terminate()
+
+    def _callback(self, in_data, frame_count, time_info, status):
+
+        nbytes = 2 * frame_count
+
+        with self._lock:
+
+            # Wait for the buffer to fill to the target depth before playing
+            if self._buffering:
+                if len(self._blocks) < self.targetDepth:
+                    return (b'\0' * nbytes, pyaudio.paContinue)
+                self._buffering = False
+
+            # Not enough audio: play what we have, pad with silence, and buffer
+            # more deeply from now on
+            if self._queuedBytes < nbytes:
+                data = b''.join(self._blocks)
+                self._blocks.clear()
+                self._queuedBytes = 0
+                self.underruns += 1
+                self.targetDepth = min(self.targetDepth+1, self.maxDepth)
+                self._buffering = True
+                self._callbacksSinceUnderrun = 0
+                return (data + b'\0' * (nbytes-len(data)), pyaudio.paContinue)
+
+            chunks = []
+            count = 0
+
+            while count < nbytes:
+                block = self._blocks.popleft()
+                chunks.append(block)
+                count += len(block)
+
+            data = b''.join(chunks)
+
+            # Return any unplayed remainder to the front of the queue
+            if count > nbytes:
+                self._blocks.appendleft(data[nbytes:])
+                data = data[:nbytes]
+
+            self._queuedBytes -= nbytes
+
+            # A long run without underruns lets the buffer get shallower; audio
+            # already queued still plays, as dropping it would be heard
+            self._callbacksSinceUnderrun += 1
+            if self._callbacksSinceUnderrun >= self.shrinkAfter:
+                self._callbacksSinceUnderrun = 0
+                self.targetDepth = max(self.targetDepth-1, self.minDepth)
+
+            return (data, pyaudio.paContinue)
@@ -16,8 +16,12 @@ GNU General Public License for more details.
 
 import struct
 
+# Compiled once, and read in place rather than from a copied slice
+_INT = struct.Struct('I')
+_SHORT = struct.Struct('h')
+
 def bytes_to_int(bytes, offset):
-    return struct.unpack('I', bytes[offset:offset+4])[0]
+    return _INT.unpack_from(bytes, offset)[0]
     
 def bytes_to_short(bytes, offset):
-    return struct.unpack('h', bytes[offset:offset+2])[0]      
+    return _SHORT.unpack_from(bytes, offset)[0]      
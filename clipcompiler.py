@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+'''
+clipcompiler.py Compile WAV files into ADPCM talk clips for the Brookstone
+Rover 2.0, in parallel.
+
+Each WAV is streamed in chunks, downmixed to mono, converted to 16 bits and
+resampled to 8 kHz, then encoded as 163-byte talk frames (160 bytes of ADPCM,
+the sample offset as an int16 and the step index as a byte), the format
+createADPCMfile.py writes to adpcm.txt.  Clips are written one file each,
+and/or as one library file that read_library loads.
+
+Unlike createADPCMfile.py, which drops the final 320 samples or fewer of a
+clip, the compiler encodes every block and pads the last one out with
+silence, so that short clips are not cut off.  Apart from that one extra
+frame, the output for an 8 kHz mono WAV is the same.
+
+Usage: clipcompiler.py [-j PROCESSES] [-o OUTDIR] [--library PATH]
+                       [--roundtrip] [--audition] WAV_OR_DIRECTORY ...
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+'''
+
+import argparse
+import audioop
+import multiprocessing
+import os
+import struct
+import wave
+
+from adpcm import encodePCMToADPCM, decodeADPCMToPCM
+
+RATE = 8000
+
+# 320 samples of 16-bit PCM in, 163 bytes out
+BLOCK_BYTES = 640
+FRAME_BYTES = 163
+
+CHUNK_FRAMES = 65536
+
+LIBRARY_MAGIC = b'RVCLIP01'
+
+
+def pcm_chunks(path, chunkFrames=CHUNK_FRAMES):
+    '''
+    Yields the WAV file at path as chunks of 8 kHz mono 16-bit PCM, reading
+    chunkFrames frames at a time.
+    '''
+
+    wr = wave.open(path, 'rb')
+
+    try:
+
+        channels = wr.getnchannels()
+        width = wr.getsampwidth()
+        rate = wr.getframerate()
+
+        state = None
+
+        while True:
+
+            fragment = wr.readframes(chunkFrames)
+
+            if not fragment:
+                break
+
+            if width != 2:
+                # 8-bit WAV samples are unsigned
+                if width == 1:
+                    fragment = audioop.bias(fragment, 1, -128)
+                fragment = audioop.lin2lin(fragment, width, 2)
+
+            if channels == 2:
+                fragment = audioop.tomono(fragment, 2, 0.5, 0.5)
+
+            elif channels > 2:
+                raise ValueError('%s has %d channels' % (path, channels))
+
+            if rate != RATE:
+                fragment, state = audioop.ratecv(fragment, 2, 1, rate, RATE, state)
+
+            yield fragment
+
+    finally:
+        wr.close()
+
+
+def encode_frames(chunks):
+    '''
+    Yields 163-byte talk frames encoding the PCM chunks, padding the last
+    frame with silence rather than dropping it, as createADPCMfile.py does.
+    '''
+
+    s_offset = 0
+    s_index = 0
+
+    pending = b''
+
+    for chunk in chunks:
+
+        pending += chunk
+
+        while len(pending) >= BLOCK_BYTES:
+            frame, s_offset, s_index = _encodeBlock(pending[:BLOCK_BYTES], s_offset, s_index)
+            pending = pending[BLOCK_BYTES:]
+            yield frame
+
+    if pending:
+        pending += b'\0' * (BLOCK_BYTES - len(pending))
+        frame, s_offset, s_index = _encodeBlock(pending, s_offset, s_index)
+        yield frame
+
+
+def decode_frames(frames):
+    '''
+    Returns 16-bit PCM bytes decoded from a string of talk frames, as the
+    Rover would play them.
+    '''
+
+    s_offset = 0
+    s_index = 0
+
+    pcm = []
+
+    for k in range(0, len(frames) - FRAME_BYTES + 1, FRAME_BYTES):
+
+        frame = frames[k:k+FRAME_BYTES]
+
+        samples = decodeADPCMToPCM(frame[:160], s_offset, s_index)
+        pcm.append(struct.pack('<%dh' % len(samples), *samples))
+
+        s_offset = struct.unpack('<h', frame[160:162])[0]
+        s_index = ord(frame[162])
+
+    return b''.join(pcm)
+
+
+def compile_clip(task):
+    '''
+    Compiles one WAV file, given as a (path, outDir, roundtrip) task, and
+    returns (name, frames).  The frames are written to outDir as name.adpcm
+    if outDir is given, and decoded back to name_roundtrip.wav there if
+    roundtrip is set.  Runs in a pool worker.
+    '''
+
+    path, outDir, roundtrip = task
+
+    name = os.path.splitext(os.path.basename(path))[0]
+
+    frames = b''.join(encode_frames(pcm_chunks(path)))
+
+    if outDir:
+
+        f = open(os.path.join(outDir, name + '.adpcm'), 'wb')
+        f.write(frames)
+        f.close()
+
+        if roundtrip:
+            write_wav(os.path.join(outDir, name + '_roundtrip.wav'), decode_frames(frames))
+
+    return name, frames
+
+
+def write_wav(path, pcm):
+    '''
+    Writes 8 kHz mono 16-bit PCM bytes to a WAV file at path.
+    '''
+
+    wf = wave.open(path, 'wb')
+    wf.setnchannels(1)
+    wf.setsampwidth(2)
+    wf.setframerate(RATE)
+    wf.writeframes(pcm)
+    wf.close()
+
+
+def write_library(path, clips):
+    '''
+    Writes a library of clips, given as a list of (name, frames), to path.
+    '''
+
+    entries = []
+    offset = 0
+
+    for name, frames in clips:
+        entries.append((name.encode('utf-8'), offset, len(frames)))
+        offset += len(frames)
+
+    f = open(path, 'wb')
+
+    f.write(LIBRARY_MAGIC)
+    f.write(struct.pack('<I', len(entries)))
+
+    for name, offset, length in entries:
+        f.write(struct.pack('<H', len(name)))
+        f.write(name)
+        f.write(struct.pack('<II', offset, length))
+
+    for name, frames in clips:
+        f.write(frames)
+
+    f.close()
+
+
+def read_library(path):
+    '''
+    Returns a dictionary mapping each clip name in the library at path to its
+    talk frames.
+    '''
+
+    f = open(path, 'rb')
+
+    try:
+
+        if f.read(len(LIBRARY_MAGIC)) != LIBRARY_MAGIC:
+            raise ValueError('%s is not a Rover clip library' % path)
+
+        count = struct.unpack('<I', f.read(4))[0]
+
+        entries = []
+
+        for k in range(count):
+            length = struct.unpack('<H', f.read(2))[0]
+            name = f.read(length).decode('utf-8')
+            entries.append((name,) + struct.unpack('<II', f.read(8)))
+
+        data = f.read()
+
+    finally:
+        f.close()
+
+    return dict((name, data[offset:offset+length]) for name, offset, length in entries)
+
+
+def audition(frames):
+    '''
+    Plays talk frames through the speakers as the Rover would.
+    '''
+
+    import pyaudio
+
+    p = pyaudio.PyAudio()
+
+    stream = p.open(format=pyaudio.paInt16, channels=1, rate=RATE, output=True)
+
+    stream.write(decode_frames(frames))
+
+    stream.close()
+    p.terminate()
+
+
+def find_wavs(paths):
+    '''
+    Returns the WAV files named by paths, expanding directories.
+    '''
+
+    wavs = []
+
+    for path in paths:
+
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith('.wav'):
+                    wavs.append(os.path.join(path, name))
+
+        else:
+            wavs.append(path)
+
+    return wavs
+
+
+def compile_clips(paths, outDir=None, roundtrip=False, processes=None):
+    '''
+    Compiles the WAV files at paths on a pool of processes (default: one per
+    core) and returns a list of (name, frames) in the order of paths.  See
+    compile_clip for outDir and roundtrip.
+    '''
+
+    if outDir and not os.path.isdir(outDir):
+        os.makedirs(outDir)
+
+    tasks = [(path, outDir, roundtrip) for path in paths]
+
+    pool = multiprocessing.Pool(processes)
+
+    try:
+        clips = pool.map(compile_clip, tasks, 1)
+
+    finally:
+        pool.close()
+        pool.join()
+
+    return clips
+
+
+def _encodeBlock(block, s_offset, s_index):
+
+    adpcm = encodePCMToADPCM(block, s_offset, s_index)
+
+    # The frame carries the encoder state after its samples
+    frame = ''.join(map(chr, adpcm[:160])) + struct.pack('<h', adpcm[160]) + chr(adpcm[161])
+
+    return frame, adpcm[160], adpcm[161]
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Compile WAV files into Rover talk clips.')
+    parser.add_argument('inputs', nargs='+', metavar='WAV_OR_DIRECTORY')
+    parser.add_argument('-j', '--processes', type=int, default=None, help='worker processes')
+    parser.add_argument('-o', '--outdir', help='write each clip here as NAME.adpcm')
+    parser.add_argument('--library', metavar='PATH', help='write all clips to one library file')
+    parser.add_argument('--roundtrip', action='store_true', help='also write NAME_roundtrip.wav to OUTDIR')
+    parser.add_argument('--audition', action='store_true', help='play each clip after compiling')
+    args = parser.parse_args()
+
+    if not args.outdir and not args.library:
+        parser.error('give an output directory, a library path, or both')
+
+    clips = compile_clips(find_wavs(args.inputs), args.outdir, args.roundtrip, args.processes)
+
+    if args.library:
+        write_library(args.library, clips)
+
+    for name, frames in clips:
+
+        print('%s: %d frames, %.1f sec' % (name, len(frames) // FRAME_BYTES, \
+                                         len(frames) // FRAME_BYTES * 0.04))
+
+        if args.audition:
+            audition(frames)
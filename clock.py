@@ -0,0 +1,46 @@
+'''
+clock.py A monotonic clock for timestamping media from the Brookstone Rover 2.0.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+'''
+
+import time
+
+try:
+    from time import monotonic
+
+except ImportError:
+
+    # Older Pythons: call clock_gettime(CLOCK_MONOTONIC) directly
+    import ctypes
+    import ctypes.util
+
+    class _timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+    try:
+        _librt = ctypes.CDLL(ctypes.util.find_library('rt') or 'librt.so.1')
+        _clock_gettime = _librt.clock_gettime
+        _clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+
+        def monotonic():
+            '''
+            Returns seconds from an arbitrary start point that never goes 
+            backwards.
+            '''
+            t = _timespec()
+            _clock_gettime(1, ctypes.byref(t))
+            return t.tv_sec + t.tv_nsec * 1e-9
+
+    except (OSError, AttributeError):
+
+        # No librt (e.g. Windows): fall back to wall-clock time
+        monotonic = time.time
@@ -0,0 +1,260 @@
+'''
+commandchannel.py A single-writer, prioritized channel for commands to the
+Brookstone Rover 2.0.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+'''
+
+import collections
+import sys
+import threading
+import itertools
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+from clock import monotonic
+
+# Priorities, most urgent first
+STOP       = 0
+CONTROL    = 1
+NORMAL     = 2
+BACKGROUND = 3
+
+PRIORITY_NAMES = {STOP : 'stop', CONTROL : 'control', NORMAL : 'normal', \
+    BACKGROUND : 'background'}
+
+# The close marker comes after every command already queued
+_CLOSE = BACKGROUND + 1
+
+
+class CommandTicket:
+    ''' Tracks a submitted command until it has been sent and, if a reply was
+        asked for, the reply has been read.
+    '''
+
+    def __init__(self, request, priority, replyLength, key=None):
+
+        self.request = request
+        self.priority = priority
+        self.replyLength = replyLength
+        self.key = key
+
+        self.reply = None
+        self.error = None
+
+        # Set when a later command with the same key replaced this one
+        self.superseded = False
+        self.submitTime = monotonic()
+        self.sentTime = None
+
+        self._done = threading.Event()
+
+    def wait(self, timeout=None):
+        ''' Blocks until the command has been handled.  Returns True if it
+            was, False if timeout seconds elapsed first.
+        '''
+        return self._done.wait(timeout)
+
+    def isDone(self):
+        ''' Returns True once the command has been handled.
+        '''
+        return self._done.is_set()
+
+
+class CommandChannel(threading.Thread):
+
+    def __init__(self, sock, receive, metrics):
+        ''' Creates the thread that alone writes commands to sock, most urgent
+            priority first and in order of submission within a priority.
+            Replies are read, in the order their commands were sent, with
+            receive(count) on a second thread, so that a stop is never held
+            up behind a slow reply.  Queue depth and time to wire per priority
+            are recorded in the metrics.MetricsRegistry.
+        '''
+
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        self.sock = sock
+        self.receive = receive
+
+        self._queue = queue.PriorityQueue()
+        self._order = itertools.count()
+
+        # Once closed, commands are failed at once rather than queued
+        self._closed = False
+        self._lock = threading.Lock()
+
+        # The queued ticket for each key, which a newer one replaces
+        self._keyed = {}
+
+        # Tickets sent and still owed a reply, in the order the Rover answers
+        self._awaiting = collections.deque()
+        self._replies = threading.Condition()
+        self._sending = True
+
+        self._reader = threading.Thread(target=self._readReplies)
+        self._reader.daemon = True
+
+        self._depth = metrics.gauge('command.queue_depth')
+
+        # Requests are counted on this thread alone, as a Counter requires;
+        # those sent while logging in and starting media are not counted
+        self._sent = metrics.counter('command.requests_sent')
+        self._errors = metrics.counter('command.send_errors')
+        self._replyErrors = metrics.counter('command.reply_errors')
+        self._superseded = metrics.counter('command.superseded')
+        self._abandoned = metrics.counter('command.abandoned')
+        self._wireTimes = dict((priority, metrics.histogram('command.wire_ms.' + name)) \
+            for priority, name in PRIORITY_NAMES.items())
+
+    def submit(self, request, priority=NORMAL, replyLength=0, key=None):
+        ''' Queues request bytes for sending and returns a CommandTicket
+            without blocking.  If replyLength is nonzero, that many bytes of
+            reply are read into the ticket after sending.  A command with a
+            key replaces any command with the same key still queued, so that,
+            say, a stop sent at higher priority cannot be overtaken by an
+            earlier move of the same tread.
+        '''
+
+        ticket = CommandTicket(request, priority, replyLength, key)
+
+        with self._lock:
+
+            if self._closed:
+                ticket.error = IOError('command channel closed')
+                ticket._done.set()
+                return ticket
+
+            if key is not None:
+                queued = self._keyed.get(key)
+                if queued:
+                    queued.superseded = True
+                self._keyed[key] = ticket
+
+            self._queue.put((priority, next(self._order), ticket))
+
+        self._depth.set(self._queue.qsize())
+
+        return ticket
+
+    def close(self, timeout=None):
+        ''' Refuses further commands, sends those already queued, most urgent
+            first, and ends the thread, waiting up to timeout seconds for it.
+            Commands that fail to go out once closing has begun are counted as
+            abandoned and reported on stderr.
+        '''
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self._queue.put((_CLOSE, next(self._order), None))
+
+        self.join(timeout)
+
+    def run(self):
+
+        self._reader.start()
+
+        abandoned = 0
+
+        while True:
+
+            priority, order, ticket = self._queue.get()
+
+            self._depth.set(self._queue.qsize())
+
+            # Close marker
+            if ticket is None:
+                break
+
+            # Once taken off the queue, a ticket can no longer be replaced
+            with self._lock:
+                superseded = ticket.superseded
+                if self._keyed.get(ticket.key) is ticket:
+                    del self._keyed[ticket.key]
+
+            if superseded:
+                self._superseded.inc()
+                ticket._done.set()
+                continue
+
+            try:
+                self.sock.sendall(ticket.request)
+
+            except Exception as e:
+                self._errors.inc()
+                ticket.error = e
+                if self._closed:
+                    abandoned += 1
+                ticket._done.set()
+                continue
+
+            ticket.sentTime = monotonic()
+            self._sent.inc()
+            self._wireTimes[priority].observe(1000*(ticket.sentTime-ticket.submitTime))
+
+            # Leave the reply to the reader, so as to be free to send again
+            if ticket.replyLength:
+                with self._replies:
+                    self._awaiting.append(ticket)
+                    self._replies.notify()
+            else:
+                ticket._done.set()
+
+        # Fail anything left over rather than leave its submitter waiting
+        while True:
+            try:
+                priority, order, ticket = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if ticket:
+                ticket.error = IOError('command channel closed')
+                ticket._done.set()
+                abandoned += 1
+
+        self._depth.set(0)
+
+        # Nobody may be waiting on these, so say so
+        if abandoned:
+            self._abandoned.inc(abandoned)
+            sys.stderr.write('Rover command channel closed with %d command(s) unsent\n' % abandoned)
+
+        # The channel ends once the replies still owed have been read
+        with self._replies:
+            self._sending = False
+            self._replies.notify()
+
+        self._reader.join()
+
+    # "Private" methods ========================================================
+
+    def _readReplies(self):
+
+        while True:
+
+            with self._replies:
+                while not self._awaiting and self._sending:
+                    self._replies.wait()
+                if not self._awaiting:
+                    break
+                ticket = self._awaiting.popleft()
+
+            try:
+                ticket.reply = self.receive(ticket.replyLength)
+
+            except Exception as e:
+                self._replyErrors.inc()
+                ticket.error = e
+
+            ticket._done.set()
@@ -0,0 +1,220 @@
+'''
+controlloop.py Fixed-rate input sampling and control for driving the
+Brookstone Rover 2.0 from a joystick or similar device.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+'''
+
+import time
+
+
+def axis_to_speed(value, deadzone=0.05, steps=10, previous=None, hysteresis=0.3):
+    '''
+    Maps an axis value in [-1..+1] to a tread speed in [-1..+1], treating
+    values within deadzone of zero as zero, rescaling the rest to the full
+    range, and quantizing to the steps speeds the Rover supports.  Given the
+    previous speed, keeps it until the value strays more than hysteresis of
+    a step past the boundary, so that a stick resting there does not flip
+    between speeds.
+    '''
+
+    magnitude = (abs(value) - deadzone) / (1. - deadzone)
+
+    if magnitude <= 0:
+        return 0
+
+    magnitude = min(magnitude, 1) * steps
+
+    if previous and (previous > 0) == (value > 0) and \
+        abs(magnitude - abs(previous) * steps) < 0.5 + hysteresis:
+        return previous
+
+    speed = round(magnitude) / steps
+
+    return speed if value > 0 else -speed
+
+
+class ButtonToggle:
+
+    def __init__(self, readButton, onRoutine=None, offRoutine=None, lagSec=0.2):
+        ''' Toggles between calling onRoutine and offRoutine each time the
+            button read by readButton() is pressed.  Presses within lagSec
+            seconds of the last accepted one are ignored as bounce.
+        '''
+
+        self.readButton = readButton
+        self.onRoutine = onRoutine
+        self.offRoutine = offRoutine
+        self.lagSec = lagSec
+
+        self.isOn = False
+
+        self._wasDown = False
+        self._lastPressTime = 0
+
+    def update(self, now):
+        ''' Samples the button, toggling on a fresh press.
+        '''
+
+        down = bool(self.readButton())
+
+        if down and not self._wasDown and (now - self._lastPressTime) > self.lagSec:
+
+            self._lastPressTime = now
+
+            if self.isOn:
+                if self.offRoutine:
+                    self.offRoutine()
+                self.isOn = False
+            else:
+                if self.onRoutine:
+                    self.onRoutine()
+                self.isOn = True
+
+        self._wasDown = down
+
+
+class ControlLoop:
+
+    def __init__(self, rover, rateHz=50, deadzone=0.05, refreshSec=None):
+        ''' Creates a loop that samples inputs rateHz times a second and sends
+            the Rover only the tread and camera setpoints that have changed.
+            Nonzero tread setpoints are re-sent every refreshSec seconds
+            (default: the Rover's TREAD_DELAY_SEC).
+        '''
+
+        self.rover = rover
+        self.rateHz = rateHz
+        self.deadzone = deadzone
+        self.refreshSec = rover.TREAD_DELAY_SEC if refreshSec is None else refreshSec
+
+        self.toggles = []
+
+        self._pump = None
+        self._readTreads = None
+        self._readCamera = None
+        self._readQuit = None
+
+        self._treads = (0, 0)
+        self._treadTime = 0
+        self._camera = 0
+        self._running = False
+
+    def setPump(self, pump):
+        ''' Sets a function called at the start of each step to refresh the
+            input device, such as pygame.event.pump.
+        '''
+        self._pump = pump
+
+    def setTreadAxes(self, readLeft, readRight):
+        ''' Sets functions returning the left and right axis values in
+            [-1..+1]; + = forward.
+        '''
+        self._readTreads = (readLeft, readRight)
+
+    def setCameraButtons(self, readUp, readDown):
+        ''' Sets functions returning whether the camera up and down buttons
+            are held.
+        '''
+        self._readCamera = (readUp, readDown)
+
+    def setQuitButton(self, readQuit):
+        ''' Sets a function returning whether the quit button is pressed.
+        '''
+        self._readQuit = readQuit
+
+    def addToggle(self, readButton, onRoutine=None, offRoutine=None, lagSec=0.2):
+        ''' Adds a ButtonToggle, debounced independently of the others, and
+            returns it.
+        '''
+        toggle = ButtonToggle(readButton, onRoutine, offRoutine, lagSec)
+        self.toggles.append(toggle)
+        return toggle
+
+    def stop(self):
+        ''' Makes run() return after the current step.
+        '''
+        self._running = False
+
+    def run(self):
+        ''' Steps at the configured rate until the quit button is pressed,
+            stop() is called or the Rover session ends, then stops the treads.
+        '''
+
+        period = 1. / self.rateHz
+        nextTime = time.time()
+
+        self._running = True
+
+        while self._running and self.rover.is_active:
+
+            if not self.step():
+                break
+
+            # Sleep to the next tick; if we fell behind, start afresh
+            nextTime += period
+            delay = nextTime - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                nextTime = time.time()
+
+        self._sendTreads(0, 0, time.time())
+
+    def step(self):
+        ''' Samples the inputs once and sends any changed setpoints.  Returns
+            False if the quit button is pressed.
+        '''
+
+        now = time.time()
+
+        if self._pump:
+            self._pump()
+
+        if self._readQuit and self._readQuit():
+            return False
+
+        for toggle in self.toggles:
+            toggle.update(now)
+
+        if self._readCamera:
+            up, down = self._readCamera
+            self._sendCamera(1 if up() else -1 if down() else 0)
+
+        if self._readTreads:
+            left, right = self._readTreads
+            self._sendTreads(axis_to_speed(left(), self.deadzone, previous=self._treads[0]), \
+                             axis_to_speed(right(), self.deadzone, previous=self._treads[1]), now)
+
+        return True
+
+    def _sendCamera(self, where):
+
+        if where == self._camera:
+            return
+
+        # Reversing direction needs a stop first
+        if self._camera and where:
+            self.rover.moveCamera(0)
+
+        self.rover.moveCamera(where)
+        self._camera = where
+
+    def _sendTreads(self, left, right, now):
+
+        treads = (left, right)
+
+        refreshDue = treads != (0, 0) and (now - self._treadTime) > self.refreshSec
+
+        if treads != self._treads or refreshDue:
+            self.rover.setTreads(left, right)
+            self._treads = treads
+            self._treadTime = now
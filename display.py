@@ -0,0 +1,134 @@
+'''
+display.py Show video from the Brookstone Rover 2.0 in an OpenCV window on
+its own thread.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+'''
+
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from clock import monotonic
+
+
+class FrameDisplay(threading.Thread):
+
+    def __init__(self, title='Rover 2.0', size=(640,480), refreshHz=30, overlay=True):
+        ''' Creates a daemon thread that owns an OpenCV window of the specified
+            title and size.  Call start() to open it.  Up to refreshHz times a
+            second it decodes and shows the most recently submitted frame, with
+            an FPS and latency overlay if requested; older frames are dropped
+            undecoded.
+        '''
+
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        self.title = title
+        self.size = size
+        self.refreshHz = refreshHz
+        self.overlay = overlay
+
+        self.shown = 0
+        self.dropped = 0
+        self.fps = 0.
+        self.latency = 0.
+
+        self._latest = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def submit(self, jpegbytes, recvTime=None):
+        ''' Offers a JPEG image for display, replacing any not yet shown.
+            recvTime is when it was received on the clock.py monotonic clock
+            (default: now), for the latency overlay.  Never blocks on drawing.
+        '''
+
+        if recvTime is None:
+            recvTime = monotonic()
+
+        with self._lock:
+            if self._latest is not None:
+                self.dropped += 1
+            self._latest = (jpegbytes, recvTime)
+
+    def submitFrame(self, frame):
+        ''' Offers a mediaframe.VideoFrame for display.
+        '''
+        self.submit(frame.jpegbytes, frame.recvTime)
+
+    def attach(self, rover):
+        ''' Shows every video frame the Rover delivers.
+        '''
+        rover.addVideoListener(self.submit)
+
+    def close(self):
+        ''' Closes the window and stops the thread.
+        '''
+        self._stopped.set()
+
+    def run(self):
+
+        cv2.namedWindow(self.title, cv2.WINDOW_NORMAL)
+        cv2.resizeWindow(self.title, self.size[0], self.size[1])
+
+        period = 1. / self.refreshHz
+        lastShown = None
+
+        while not self._stopped.is_set():
+
+            start = time.time()
+
+            with self._lock:
+                latest = self._latest
+                self._latest = None
+
+            if latest:
+
+                jpegbytes, recvTime = latest
+
+                img = cv2.imdecode(np.frombuffer(jpegbytes, np.uint8), \
+                                   getattr(cv2, 'IMREAD_COLOR', 1))
+
+                if img is not None:
+
+                    now = monotonic()
+
+                    # Smooth the overlay figures so they stay readable
+                    if lastShown is not None:
+                        self.fps = 0.9*self.fps + 0.1/max(now-lastShown, 1e-6)
+                    self.latency = 0.9*self.latency + 0.1*(now-recvTime)
+                    lastShown = now
+
+                    if self.overlay:
+                        self._drawOverlay(img)
+
+                    cv2.imshow(self.title, img)
+                    self.shown += 1
+
+            # Lets the window handle its events
+            cv2.waitKey(1)
+
+            delay = period - (time.time() - start)
+            if delay > 0:
+                time.sleep(delay)
+
+        cv2.destroyWindow(self.title)
+
+    def _drawOverlay(self, img):
+
+        text = '%.1f fps  %.0f ms' % (self.fps, 1000*self.latency)
+
+        cv2.putText(img, text, (10, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0,0,0), 3)
+        cv2.putText(img, text, (10, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255,255,255), 1)
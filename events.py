@@ -0,0 +1,83 @@
+'''
+events.py Named events that detectors of Brookstone Rover 2.0 media fire, for
+listeners to be called back on and other threads to wait for.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+'''
+
+import threading
+
+from clock import monotonic
+
+
+class EventSource:
+
+    def __init__(self, events):
+        ''' Sets up the named events, the first of which wait() waits for by
+            default.
+        '''
+
+        self._defaultEvent = events[0]
+
+        self._listeners = ()
+        self._eventCounts = dict((event, 0) for event in events)
+        self._condition = threading.Condition()
+
+    def addListener(self, callback):
+        ''' Registers callback(event, value) to be called on the thread that
+            fires each event.
+        '''
+        self._listeners = self._listeners + (callback,)
+
+    def removeListener(self, callback):
+        ''' Unregisters a callback added with addListener().
+        '''
+        self._listeners = tuple(c for c in self._listeners if c != callback)
+
+    def wait(self, event=None, timeout=None):
+        ''' Blocks until the next occurrence of the specified event.  Returns
+            True if it occurred, False if timeout seconds elapsed first.
+        '''
+
+        if event is None:
+            event = self._defaultEvent
+
+        deadline = None if timeout is None else monotonic() + timeout
+
+        with self._condition:
+
+            start = self._eventCounts[event]
+
+            while self._eventCounts[event] == start:
+
+                if deadline is None:
+                    self._condition.wait()
+
+                else:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+
+        return True
+
+    # "Private" methods ========================================================
+
+    def _fire(self, events, value):
+
+        with self._condition:
+            for event in events:
+                self._eventCounts[event] += 1
+            self._condition.notify_all()
+
+        for event in events:
+            for callback in self._listeners:
+                callback(event, value)
@@ -0,0 +1,391 @@
+'''
+framebus.py Share video and audio from the Brookstone Rover 2.0 with other
+processes through a shared-memory ring.
+
+One FramePublisher, attached to a Rover, writes each JPEG frame and PCM block
+once into the ring.  Any number of FrameSubscriber processes read it in place,
+each at its own pace.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+'''
+
+import array
+import errno
+import mmap
+import os
+import struct
+import time
+import weakref
+
+# Use multiprocessing.shared_memory where available, else a file in /dev/shm
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+from clock import monotonic
+
+VIDEO = 1
+AUDIO = 2
+
+_MAGIC = b'RVBS'
+
+# magic, slot count, slot size, latest sequence number
+_HEADER = struct.Struct('<4sIIQ')
+_HEADER_SIZE = 64
+
+# sequence at start of write, kind, length, monotonic time, sequence at end
+_SLOT = struct.Struct('<QBxxxIdQ')
+
+# Segments created in this process, by name, and the process ID that created
+# them, which a forked child inherits
+_created = {}
+
+
+class BusFrame:
+    ''' A frame read from the bus.  data is a read-only view into shared
+        memory; once done with it, call isValid() to check that the publisher
+        did not overwrite the slot meanwhile.
+    '''
+
+    def __init__(self, bus, offset, seq, kind, data, timestamp):
+
+        self.seq = seq
+        self.kind = kind
+        self.data = data
+        self.timestamp = timestamp
+
+        self._bus = bus
+        self._offset = offset
+
+    def isValid(self):
+        ''' Returns True if the data still holds this frame.
+        '''
+        return self._bus._slotSeqs(self._offset) == (self.seq, self.seq)
+
+    def copy(self):
+        ''' Returns the data as bytes.
+        '''
+        if isinstance(self.data, memoryview):
+            return self.data.tobytes()
+        return str(self.data)
+
+    def samples(self):
+        ''' Returns audio data as an array of int16 PCM samples.
+        '''
+        return array.array('h', self.copy())
+
+    def release(self):
+        ''' Gives up the view into shared memory.  The subscriber's close()
+            releases any frames still held.
+        '''
+        if hasattr(self.data, 'release'):
+            self.data.release()
+        self.data = None
+
+
+class _Segment:
+
+    def __init__(self, name, size, create):
+
+        self.name = name
+
+        if shared_memory:
+            self._shm = _openSharedMemory(name, create, size)
+            self.buf = self._shm.buf
+            if create:
+                _created[name] = os.getpid()
+
+        else:
+            self._shm = None
+            self._path = os.path.join('/dev/shm', name)
+            fd = os.open(self._path, os.O_RDWR | (os.O_CREAT | os.O_EXCL if create else 0))
+            try:
+                if create:
+                    os.ftruncate(fd, size)
+                else:
+                    size = os.fstat(fd).st_size
+                self.buf = mmap.mmap(fd, size)
+            finally:
+                os.close(fd)
+
+        # Views into an mmap need buffer() on older Pythons
+        try:
+            self._view = memoryview(self.buf)
+        except TypeError:
+            self._view = None
+
+    def view(self, offset, length):
+
+        if self._view is not None:
+            return self._view[offset:offset+length]
+
+        return buffer(self.buf, offset, length)
+
+    def close(self, unlink=False):
+
+        # Views must be released before shared memory can be closed
+        if self._view is not None and hasattr(self._view, 'release'):
+            self._view.release()
+        self._view = None
+
+        # A segment already gone, say removed by hand, need not be unlinked
+        try:
+
+            if self._shm:
+                self.buf = None
+                self._shm.close()
+                if unlink:
+                    _created.pop(self.name, None)
+                    self._shm.unlink()
+
+            else:
+                self.buf.close()
+                if unlink:
+                    os.unlink(self._path)
+
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            if self._shm:
+                _untrack(self._shm)
+
+
+def _untrack(shm):
+
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except (ImportError, AttributeError):
+        pass
+
+
+def _openSharedMemory(name, create, size):
+
+    # Only the creator should own the segment: before Python 3.13, every
+    # process that attaches registers it with its resource tracker, which
+    # unlinks it when that process exits
+    if not create:
+        try:
+            return shared_memory.SharedMemory(name, create, size, track=False)
+        except TypeError:
+            pass
+
+    shm = shared_memory.SharedMemory(name, create, size)
+
+    # In the creator's own process, attaching leaves its one registration, which
+    # unlink() will remove
+    if not create and _created.get(name) != os.getpid():
+        _untrack(shm)
+
+    return shm
+
+
+class _Bus:
+
+    def _slotOffset(self, seq):
+
+        return _HEADER_SIZE + ((seq-1) % self.slotCount) * (_SLOT.size + self.slotSize)
+
+    def _slotSeqs(self, offset):
+
+        header = _SLOT.unpack_from(self.segment.buf, offset)
+        return header[0], header[4]
+
+    def _latest(self):
+
+        return _HEADER.unpack_from(self.segment.buf, 0)[3]
+
+
+class FramePublisher(_Bus):
+
+    def __init__(self, name='rover-frames', slotCount=64, slotSize=262144):
+        ''' Creates a shared-memory ring of slotCount slots, each holding one
+            payload of up to slotSize bytes, under the specified name.
+        '''
+
+        self.name = name
+        self.slotCount = slotCount
+        self.slotSize = slotSize
+
+        self.published = 0
+        self.oversized = 0
+
+        size = _HEADER_SIZE + slotCount * (_SLOT.size + slotSize)
+
+        self.segment = _Segment(name, size, True)
+
+        _HEADER.pack_into(self.segment.buf, 0, _MAGIC, slotCount, slotSize, 0)
+
+    def attach(self, rover):
+        ''' Publishes every video frame and audio block the Rover delivers.
+        '''
+        rover.addVideoListener(self.publishVideo)
+        rover.addAudioListener(self.publishAudio)
+
+    def detach(self, rover):
+        ''' Stops publishing from the Rover.
+        '''
+        rover.removeVideoListener(self.publishVideo)
+        rover.removeAudioListener(self.publishAudio)
+
+    def publishVideo(self, jpegbytes):
+        ''' Writes a JPEG frame to the ring.
+        '''
+        self.publish(VIDEO, jpegbytes)
+
+    def publishAudio(self, pcmsamples):
+        ''' Writes a block of PCM samples to the ring as int16.
+        '''
+        samples = array.array('h', pcmsamples)
+        self.publish(AUDIO, samples.tobytes() if hasattr(samples, 'tobytes') else samples.tostring())
+
+    def publish(self, kind, data):
+        ''' Writes a payload of the specified kind to the next slot.
+        '''
+
+        if len(data) > self.slotSize:
+            self.oversized += 1
+            return
+
+        seq = self._latest() + 1
+        offset = self._slotOffset(seq)
+        buf = self.segment.buf
+
+        # Readers treat a slot whose start and end sequences differ as torn
+        _SLOT.pack_into(buf, offset, seq, kind, len(data), monotonic(), 0)
+
+        start = offset + _SLOT.size
+        buf[start:start+len(data)] = data
+
+        _SLOT.pack_into(buf, offset, seq, kind, len(data), monotonic(), seq)
+        _HEADER.pack_into(buf, 0, _MAGIC, self.slotCount, self.slotSize, seq)
+
+        self.published += 1
+
+    def close(self):
+        ''' Releases and removes the shared memory.
+        '''
+        self.segment.close(True)
+
+
+class FrameSubscriber(_Bus):
+
+    def __init__(self, name='rover-frames', kinds=(VIDEO,), every=1, maxFps=None, \
+        pollSec=0.002):
+        ''' Attaches to the ring published under the specified name, reading
+            frames of the specified kinds.  Only every Nth such frame is
+            returned, and no more than maxFps a second; read() checks for new
+            frames every pollSec seconds while waiting.
+        '''
+
+        self.name = name
+        self.kinds = kinds
+        self.every = every
+        self.maxFps = maxFps
+        self.pollSec = pollSec
+
+        self.received = 0
+        self.missed = 0
+        self.torn = 0
+
+        self.segment = _Segment(name, 0, False)
+
+        magic, self.slotCount, self.slotSize, latest = \
+            _HEADER.unpack_from(self.segment.buf, 0)
+
+        if magic != _MAGIC:
+            raise ValueError('%s is not a Rover frame bus' % name)
+
+        # Start with the next frame published
+        self._lastSeq = latest
+        self._matched = 0
+        self._lastTime = 0
+
+        # Frames returned whose views into shared memory may still be held
+        self._frames = weakref.WeakSet()
+
+    def read(self, timeout=None):
+        ''' Returns the next BusFrame allowed by the rate limits, or None if
+            timeout seconds pass without one.
+        '''
+
+        deadline = None if timeout is None else time.time() + timeout
+
+        while True:
+
+            frame = self._next()
+
+            if frame:
+                return frame
+
+            if deadline is not None and time.time() >= deadline:
+                return None
+
+            time.sleep(self.pollSec)
+
+    def __iter__(self):
+
+        while True:
+            yield self.read()
+
+    def close(self):
+        ''' Releases any frames still held and detaches from the shared memory.
+        '''
+
+        for frame in list(self._frames):
+            frame.release()
+
+        self.segment.close()
+
+    def _next(self):
+
+        latest = self._latest()
+
+        # Slots older than one trip round the ring have been overwritten
+        if latest - self._lastSeq > self.slotCount:
+            self.missed += latest - self._lastSeq - self.slotCount
+            self._lastSeq = latest - self.slotCount
+
+        while self._lastSeq < latest:
+
+            self._lastSeq += 1
+            seq = self._lastSeq
+
+            offset = self._slotOffset(seq)
+            start, kind, length, timestamp, end = _SLOT.unpack_from(self.segment.buf, offset)
+
+            if start != seq or end != seq:
+                self.torn += 1
+                continue
+
+            if kind not in self.kinds:
+                continue
+
+            self._matched += 1
+
+            if (self._matched - 1) % self.every:
+                continue
+
+            if self.maxFps and (timestamp - self._lastTime) < 1. / self.maxFps:
+                continue
+
+            self._lastTime = timestamp
+            self.received += 1
+
+            data = self.segment.view(offset + _SLOT.size, length)
+
+            frame = BusFrame(self, offset, seq, kind, data, timestamp)
+            self._frames.add(frame)
+
+            return frame
+
+        return None
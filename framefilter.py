@@ -0,0 +1,108 @@
+'''
+framefilter.py Suppress duplicate and near-static video frames streamed from
+the Brookstone Rover 2.0.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+'''
+
+import time
+import zlib
+
+# Try to start OpenCV for near-static detection
+try:
+    import cv2
+    import numpy as np
+except:
+    cv2 = None
+
+
+def jpegbytes_to_thumbnail(jpegbytes, size):
+    '''
+    Accepts JPEG image bytes and returns a small greyscale NumPy image of the
+    specified (width, height), or None if the bytes cannot be decoded.
+    '''
+
+    # Let libjpeg scale down while decoding when OpenCV supports it
+    flags = getattr(cv2, 'IMREAD_REDUCED_GRAYSCALE_8', 0)
+
+    img = cv2.imdecode(np.frombuffer(jpegbytes, np.uint8), flags)
+
+    if img is None:
+        return None
+
+    return cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+
+
+class FrameSuppressor:
+
+    def __init__(self, threshold=2.0, refreshSec=1.0, thumbSize=(32,24), \
+        compareThumbnails=True):
+        ''' Creates a filter that drops video frames identical to the previous
+            frame, and (when OpenCV is available and compareThumbnails is set)
+            frames whose greyscale thumbnail differs from the last delivered
+            one by less than threshold grey levels on average.  A frame is
+            always delivered if none has been for refreshSec seconds; None
+            disables the forced refresh.
+        '''
+
+        self.threshold = threshold
+        self.refreshSec = refreshSec
+        self.thumbSize = thumbSize
+        self.compareThumbnails = compareThumbnails and cv2 is not None
+
+        self.delivered = 0
+        self.droppedDuplicate = 0
+        self.droppedStatic = 0
+
+        self._lastKey = None
+        self._lastThumb = None
+        self._lastDeliveryTime = 0
+
+    def accept(self, jpegbytes):
+        ''' Returns True if the frame should be delivered, False if it should
+            be dropped.
+        '''
+
+        currTime = time.time()
+
+        refreshDue = self.refreshSec is not None and \
+            (currTime - self._lastDeliveryTime) >= self.refreshSec
+
+        # Cheap check first: length plus CRC of the payload
+        key = (len(jpegbytes), zlib.crc32(jpegbytes))
+
+        if key == self._lastKey and not refreshDue:
+            self.droppedDuplicate += 1
+            return False
+
+        self._lastKey = key
+
+        # Then compare a low-resolution thumbnail against the last delivered one
+        thumb = None
+
+        if self.compareThumbnails:
+
+            thumb = jpegbytes_to_thumbnail(jpegbytes, self.thumbSize)
+
+            if thumb is not None and self._lastThumb is not None and not refreshDue:
+
+                diff = np.abs(thumb.astype(np.int16) - self._lastThumb).mean()
+
+                if diff < self.threshold:
+                    self.droppedStatic += 1
+                    return False
+
+        if thumb is not None:
+            self._lastThumb = thumb.astype(np.int16)
+
+        self._lastDeliveryTime = currTime
+        self.delivered += 1
+        return True
@@ -0,0 +1,143 @@
+'''
+framerate.py Adaptive control of the Brookstone Rover 2.0 camera frame rate.
+
+The controller lowers the rate when video backs up ahead of or inside our
+consumers, and raises it again once they keep up, so that the Rover's Wi-Fi
+and our CPU are not spent on frames that would only be dropped.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+'''
+
+import threading
+
+
+class FrameRateController(threading.Thread):
+
+    def __init__(self, rover, minFps=5, maxFps=30, periodSec=1.0, maxBufferBytes=65536, \
+        maxBusy=0.8, maxDropRatio=0.2, raiseAfter=3, raiseStep=2, lowerFactor=0.75):
+        ''' Creates a daemon thread that every periodSec seconds looks at the
+            Rover's metrics and sets the camera rate within [minFps..maxFps].
+            The rate is cut by lowerFactor when any of these shows a backlog:
+
+              - more than maxBufferBytes received but not yet parsed
+              - video handlers busy for more than maxBusy of each frame period
+              - more than maxDropRatio of delivered frames dropped by a
+                consumer registered with addDropCounter()
+
+            It is raised by raiseStep after raiseAfter periods in a row with
+            none of these and handlers busy for under half of maxBusy.
+        '''
+
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        self.rover = rover
+        self.minFps = minFps
+        self.maxFps = maxFps
+        self.periodSec = periodSec
+        self.maxBufferBytes = maxBufferBytes
+        self.maxBusy = maxBusy
+        self.maxDropRatio = maxDropRatio
+        self.raiseAfter = raiseAfter
+        self.raiseStep = raiseStep
+        self.lowerFactor = lowerFactor
+
+        self.fps = maxFps
+        self.lowered = 0
+        self.raised = 0
+
+        metrics = rover.metrics
+        self._bufferBytes = metrics.gauge('media.buffer_bytes')
+        self._delivered = metrics.counter('video.frames_delivered')
+        self._callbackTime = metrics.histogram('video.callback_ms')
+        self._busyGauge = metrics.gauge('video.handler_busy')
+
+        self._dropCounters = ()
+        self._last = None
+        self._healthy = 0
+        self._stopped = threading.Event()
+
+    def addDropCounter(self, readCount):
+        ''' Counts frames a consumer drops as backlog.  readCount() should
+            return the consumer's running total, such as a
+            display.FrameDisplay's dropped attribute.
+        '''
+        self._dropCounters = self._dropCounters + (readCount,)
+
+    def stop(self):
+        ''' Stops adjusting the rate, leaving it where it is.
+        '''
+        self._stopped.set()
+
+    def run(self):
+
+        self.rover.setFrameRate(self.fps)
+
+        while not self._stopped.is_set() and self.rover.is_active:
+            self._stopped.wait(self.periodSec)
+            if not self._stopped.is_set():
+                self.step()
+
+    def step(self):
+        ''' Takes one look at the metrics since the previous call and adjusts
+            the rate if needed.  Returns the rate in effect afterwards.
+        '''
+
+        current = (self._delivered.value, self._callbackTime.count, \
+                   self._callbackTime.total, self._drops())
+
+        # The first look only sets the baseline
+        if self._last is None:
+            self._last = current
+            return self.fps
+
+        delivered, handled, handlerMsec, drops = \
+            [now - then for now, then in zip(current, self._last)]
+        self._last = current
+
+        # Fraction of each frame period spent in handlers at the current rate
+        busy = self.fps * (handlerMsec / handled) / 1000. if handled else 0.
+        self._busyGauge.set(busy)
+
+        backlogged = self._bufferBytes.value > self.maxBufferBytes or \
+                     busy > self.maxBusy or \
+                     drops > self.maxDropRatio * max(delivered, 1)
+
+        if backlogged:
+            self._healthy = 0
+            self._setRate(max(self.minFps, int(self.fps * self.lowerFactor)))
+            return self.fps
+
+        if busy < self.maxBusy / 2:
+            self._healthy += 1
+
+        if self._healthy >= self.raiseAfter:
+            self._healthy = 0
+            self._setRate(min(self.maxFps, self.fps + self.raiseStep))
+
+        return self.fps
+
+    def _drops(self):
+
+        return sum(readCount() for readCount in self._dropCounters)
+
+    def _setRate(self, fps):
+
+        if fps == self.fps:
+            return
+
+        if fps < self.fps:
+            self.lowered += 1
+        else:
+            self.raised += 1
+
+        self.fps = fps
+        self.rover.setFrameRate(fps)
@@ -0,0 +1,247 @@
+'''
+headers.py The layout of the packet headers of the Brookstone Rover 2.0,
+described once for decoding one packet at a time or a whole recording at once.
+
+Every packet starts with a 23-byte header: the marker (MO_O on the command
+connection, MO_V on the media connection), the op, and the length of what
+follows.  Video (op 1), audio (op 2) and talk (op 3) packets add a sub-header
+before their payload:
+
+    op 1 video               ops 2 and 3 audio and talk
+    23  timestamp            23  tick
+    27  frame ID             27  serial number
+    31  (pad)                31  timestamp
+    32  JPEG length          35  (pad)
+    36  JPEG bytes ...       36  ADPCM length
+                             40  160 bytes of ADPCM
+                            200  sample offset (int16)
+                            202  step index
+
+All integers are little-endian.  The struct.Struct schemas below need only
+the standard library; read_headers, which decodes every header of a
+recording as NumPy structured arrays over a memory map, needs NumPy, but
+imports it only when called, so that the live session does not pay for it.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+'''
+
+import mmap
+import struct
+
+# Packet ops
+VIDEO = 1
+AUDIO = 2
+TALK = 3
+
+# marker, op, length
+HEADER = struct.Struct('<4sB10xI4x')
+
+# timestamp, frame ID, JPEG length
+VIDEO_SUBHEADER = struct.Struct('<IIxI')
+
+# tick, serial number, timestamp, ADPCM length; talk packets are the same
+AUDIO_SUBHEADER = struct.Struct('<IIIxI')
+
+# sample offset, step index
+ADPCM_TRAILER = struct.Struct('<hB')
+
+VIDEO_HEADER_SIZE = HEADER.size + VIDEO_SUBHEADER.size
+AUDIO_HEADER_SIZE = HEADER.size + AUDIO_SUBHEADER.size
+ADPCM_BYTES = 160
+AUDIO_PACKET_SIZE = AUDIO_HEADER_SIZE + ADPCM_BYTES + ADPCM_TRAILER.size
+
+# NumPy dtypes of video and audio headers, built on first use
+_dtypes = None
+
+
+def unpack_header(buf, offset=0):
+    '''
+    Returns (marker, op, length) for the packet starting at offset in buf.
+    '''
+    return HEADER.unpack_from(buf, offset)
+
+
+def unpack_video(buf, offset=0):
+    '''
+    Returns (timestamp, frame ID, JPEG length) for the op 1 packet starting at
+    offset in buf.
+    '''
+    return VIDEO_SUBHEADER.unpack_from(buf, offset + HEADER.size)
+
+
+def unpack_audio(buf, offset=0):
+    '''
+    Returns (tick, serial number, timestamp, ADPCM length, sample offset,
+    step index) for the op 2 or 3 packet starting at offset in buf.
+    '''
+    return AUDIO_SUBHEADER.unpack_from(buf, offset + HEADER.size) + \
+           ADPCM_TRAILER.unpack_from(buf, offset + AUDIO_HEADER_SIZE + ADPCM_BYTES)
+
+
+def header_dtypes():
+    '''
+    Returns the NumPy structured dtypes (video, audio) of op 1 packets up to
+    their JPEG bytes and of whole op 2 packets.  Needs NumPy.
+    '''
+
+    global _dtypes
+
+    if _dtypes is None:
+
+        import numpy as np
+
+        video = np.dtype({'names'   : ['marker', 'op', 'length', 'timestamp', 'frameId', \
+                                       'jpegLength'],
+                          'formats' : ['S4', 'u1', '<u4', '<u4', '<u4', '<u4'],
+                          'offsets' : [0, 4, 15, 23, 27, 32],
+                          'itemsize': VIDEO_HEADER_SIZE})
+
+        audio = np.dtype({'names'   : ['marker', 'op', 'length', 'tick', 'serial', \
+                                       'timestamp', 'adpcmLength', 'sampleOffset', 'index'],
+                          'formats' : ['S4', 'u1', '<u4', '<u4', '<u4', '<u4', '<u4', '<i2', 'u1'],
+                          'offsets' : [0, 4, 15, 23, 27, 31, 36, 200, 202],
+                          'itemsize': AUDIO_PACKET_SIZE})
+
+        _dtypes = video, audio
+
+    return _dtypes
+
+
+class RecordingHeaders:
+    ''' The headers of every packet of a recording, as NumPy arrays.  recvTimes,
+        offsets (of each packet in the file), lengths and ops have a row per
+        packet; video and audio are structured arrays of the dtypes returned
+        by header_dtypes() with a row per well-formed packet of each kind,
+        received at videoTimes and audioTimes.
+    '''
+
+    def __init__(self, recvTimes, offsets, lengths, ops, videoTimes, video, audioTimes, audio):
+
+        self.recvTimes = recvTimes
+        self.offsets = offsets
+        self.lengths = lengths
+        self.ops = ops
+        self.videoTimes = videoTimes
+        self.video = video
+        self.audioTimes = audioTimes
+        self.audio = audio
+
+    def packets(self):
+        ''' Returns the number of packets.
+        '''
+        return len(self.ops)
+
+
+def read_headers(path, start=None, end=None, blockRows=65536):
+    '''
+    Decodes the header of every packet of the recording at path whose record
+    starts within the byte range [start..end), by default the whole file, and
+    returns a RecordingHeaders.  Only the record headers are visited one by
+    one; packet headers are gathered from a memory map blockRows at a time
+    and decoded by NumPy.
+    '''
+
+    try:
+        import numpy as np
+    except ImportError:
+        raise ImportError('read_headers needs NumPy')
+
+    from recording import MAGIC
+
+    videoDtype, audioDtype = header_dtypes()
+
+    f = open(path, 'rb')
+
+    try:
+
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('%s is not a Rover recording' % path)
+
+        f.seek(0, 2)
+        size = f.tell()
+
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    finally:
+        f.close()
+
+    try:
+        recvTimes, offsets, lengths = _scanRecords(data, size, start, end)
+
+        buf = np.frombuffer(data, np.uint8)
+
+        ops = buf[offsets + 4] if len(offsets) else np.zeros(0, np.uint8)
+
+        isVideo = (ops == VIDEO) & (lengths >= VIDEO_HEADER_SIZE)
+        isAudio = (ops == AUDIO) & (lengths >= AUDIO_PACKET_SIZE)
+
+        video = _gather(buf, offsets[isVideo], videoDtype, blockRows)
+        audio = _gather(buf, offsets[isAudio], audioDtype, blockRows)
+
+        del buf
+
+    finally:
+        data.close()
+
+    return RecordingHeaders(recvTimes, offsets, lengths, ops, recvTimes[isVideo], video, \
+                            recvTimes[isAudio], audio)
+
+
+def _scanRecords(data, size, start, end):
+
+    import numpy as np
+
+    from recording import MAGIC, RECORD
+
+    offset = start or len(MAGIC)
+
+    if end is None or end > size:
+        end = size
+
+    recvTimes = []
+    offsets = []
+    lengths = []
+
+    # Records vary in length, so must be walked in order
+    while offset < end and offset + RECORD.size <= size:
+
+        recvTime, length = RECORD.unpack_from(data, offset)
+
+        offset += RECORD.size
+
+        # A truncated final record is ignored
+        if offset + length > size:
+            break
+
+        recvTimes.append(recvTime)
+        offsets.append(offset)
+        lengths.append(length)
+
+        offset += length
+
+    return np.array(recvTimes, np.float64), np.array(offsets, np.int64), \
+           np.array(lengths, np.int64)
+
+
+def _gather(buf, offsets, dtype, blockRows):
+
+    import numpy as np
+
+    headers = np.empty(len(offsets), dtype)
+
+    columns = np.arange(dtype.itemsize)
+
+    # Copy each header's bytes into its row, a block of rows at a time
+    for k in range(0, len(offsets), blockRows):
+        rows = buf[offsets[k:k+blockRows, np.newaxis] + columns]
+        headers[k:k+blockRows] = rows.view(dtype).reshape(-1)
+
+    return headers
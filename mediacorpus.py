@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+'''
+mediacorpus.py Generate raw media streams, as the Brookstone Rover 2.0 sends
+them, that stress the media parser, along with the packets it should cut from
+each.
+
+Cases cover MO_V markers inside JPEG payloads, truncated frames, garbage
+between packets, unknown ops and bursts of small audio packets.  verify()
+also feeds each case split at every byte boundary.
+
+Usage: mediacorpus.py [DIRECTORY]
+
+writes each case to DIRECTORY (default: corpus) as NAME.stream, the raw
+bytes, and NAME.rec, the expected packets as a recording.py recording.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+'''
+
+import os
+import random
+import struct
+import sys
+
+from mediaparser import MediaParser, VIDEO, AUDIO
+from recording import MediaRecorder, read_packets
+
+
+def video_packet(jpegbytes, timestamp=0, frameId=0):
+    '''
+    Returns an op 1 packet, starting with its MO_V marker, carrying jpegbytes.
+    '''
+    return 'MO_V' + chr(VIDEO) + '\0'*18 + struct.pack('<II', timestamp, frameId) + '\0' + \
+           struct.pack('<I', len(jpegbytes)) + jpegbytes
+
+
+def audio_packet(adpcm, tick=0, serial=0, timestamp=0, offset=0, index=0):
+    '''
+    Returns an op 2 packet, starting with its MO_V marker, carrying 160 bytes
+    of ADPCM and the decoder's starting offset and index.
+    '''
+    return 'MO_V' + chr(AUDIO) + '\0'*18 + struct.pack('<III', tick, serial, timestamp) + '\0' + \
+           struct.pack('<I', len(adpcm)) + adpcm + struct.pack('<h', offset) + chr(index)
+
+
+def fake_jpeg(rng, size):
+    '''
+    Returns size bytes that start and end like a JPEG image.
+    '''
+    body = ''.join(chr(rng.randint(0, 255)) for k in range(max(size-4, 0)))
+    return ('\xff\xd8' + body + '\xff\xd9')[:size]
+
+
+class CorpusCase:
+    ''' A raw stream and the packets, each without its MO_V marker, that a
+        correct parser cuts from it.
+    '''
+
+    def __init__(self, name, stream, expected):
+
+        self.name = name
+        self.stream = stream
+        self.expected = expected
+
+    def frames(self):
+        ''' Returns the number of packets expected.
+        '''
+        return len(self.expected)
+
+
+class _Builder:
+
+    def __init__(self):
+
+        self.parts = []
+        self.expected = []
+
+    def add(self, packet, expect=True):
+
+        self.parts.append(packet)
+
+        if expect:
+            self.expected.append((ord(packet[4]), packet[4:]))
+
+    def build(self, name):
+
+        return CorpusCase(name, ''.join(self.parts), self.expected)
+
+
+def generate(seed=0, scale=1, jpegScale=1):
+    '''
+    Returns a list of CorpusCases, reproducibly from seed; scale multiplies
+    the number of packets in each, and jpegScale the size of JPEG frames.
+    '''
+
+    rng = random.Random(seed)
+
+    cases = []
+
+    adpcm = lambda: ''.join(chr(rng.randint(0, 255)) for k in range(160))
+
+    # Video and audio interleaved as the Rover sends them
+    b = _Builder()
+    for k in range(int(200*scale)):
+        b.add(video_packet(fake_jpeg(rng, int(rng.randint(8000, 20000)*jpegScale)), k, k))
+        b.add(audio_packet(adpcm(), 40*k, k, k))
+        b.add(audio_packet(adpcm(), 40*k+20, k, k))
+    cases.append(b.build('interleaved'))
+
+    # Markers inside payloads, including at their very start and end
+    b = _Builder()
+    for k in range(int(100*scale)):
+        jpeg = fake_jpeg(rng, int(rng.randint(2000, 12000)*jpegScale))
+        where = [2, len(jpeg)//2, len(jpeg)-6][k % 3]
+        jpeg = jpeg[:where] + 'MO_V' + jpeg[where+4:]
+        if k % 5 == 0:
+            jpeg = jpeg[:-4] + 'MO_V'
+        b.add(video_packet(jpeg, k, k))
+        b.add(audio_packet(adpcm()[:80] + 'MO_V' + adpcm()[84:], k, k, k))
+    cases.append(b.build('marker-in-payload'))
+
+    # Frames cut short by a lost segment, followed by whole packets
+    b = _Builder()
+    for k in range(int(100*scale)):
+        packet = video_packet(fake_jpeg(rng, int(rng.randint(4000, 9000)*jpegScale)), k, k)
+        if k % 4 == 1:
+            b.add(packet[:rng.randint(10, len(packet)-1)], False)
+        else:
+            b.add(packet)
+        b.add(audio_packet(adpcm(), k, k, k))
+    cases.append(b.build('truncated'))
+
+    # Garbage before the first packet and between packets, and unknown ops
+    b = _Builder()
+    b.add(''.join(chr(rng.randint(0, 255)) for k in range(777)), False)
+    for k in range(int(100*scale)):
+        if k % 7 == 3:
+            b.add('MO_V' + chr(9) + '\0'*40, False)
+        b.add(video_packet(fake_jpeg(rng, int(rng.randint(3000, 6000)*jpegScale)), k, k))
+        if k % 5 == 2:
+            b.add(''.join(chr(rng.randint(0, 255)) for j in range(rng.randint(1, 300))), False)
+    cases.append(b.build('garbage'))
+
+    # Long runs of audio with no video
+    b = _Builder()
+    for k in range(int(2000*scale)):
+        b.add(audio_packet(adpcm(), 40*k, k, k, rng.randint(-2000, 2000), rng.randint(0, 88)))
+    cases.append(b.build('audio-burst'))
+
+    return cases
+
+
+def generate_small(seed=0):
+    '''
+    Returns CorpusCases like generate()'s, but short enough for verify() to
+    split each at every byte boundary.
+    '''
+
+    cases = generate(seed, 0.05, 0.02)
+
+    for case in cases:
+        case.name += '-small'
+
+    return cases
+
+
+def parse(stream, chunkSize, parser=None):
+    '''
+    Feeds stream to a MediaParser in chunks of chunkSize bytes and returns the
+    (op, pack) it cuts.
+    '''
+
+    if parser is None:
+        parser = MediaParser()
+
+    packets = []
+
+    for k in range(0, len(stream), chunkSize):
+        for op, pack, recvTime in parser.feed(stream[k:k+chunkSize], k):
+            packets.append((op, pack))
+
+    for op, pack, recvTime in parser.flush():
+        packets.append((op, pack))
+
+    return packets
+
+
+def verify(cases, chunkSizes=(1, 3, 7, 64, 1460, 65536), splitLimit=32768):
+    '''
+    Checks that every case parses to its expected packets when fed in chunks
+    of each size, and, for cases of at most splitLimit bytes, when split in
+    two at every byte boundary.  Returns a list of (case name, description)
+    failures.
+    '''
+
+    failures = []
+
+    for case in cases:
+
+        for chunkSize in chunkSizes:
+            if parse(case.stream, chunkSize) != case.expected:
+                failures.append((case.name, 'chunks of %d bytes' % chunkSize))
+
+        stream = case.stream
+
+        if len(stream) > splitLimit:
+            continue
+
+        for split in range(1, len(stream)):
+            parser = MediaParser()
+            packets = [(op, pack) for op, pack, t in parser.feed(stream[:split], 0)]
+            packets += [(op, pack) for op, pack, t in parser.feed(stream[split:], 1)]
+            packets += [(op, pack) for op, pack, t in parser.flush()]
+            if packets != case.expected:
+                failures.append((case.name, 'split at byte %d' % split))
+                break
+
+    return failures
+
+
+def write_corpus(directory, cases):
+    '''
+    Writes each case to directory as NAME.stream and NAME.rec.
+    '''
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    for case in cases:
+
+        f = open(os.path.join(directory, case.name + '.stream'), 'wb')
+        f.write(case.stream)
+        f.close()
+
+        recorder = MediaRecorder(os.path.join(directory, case.name + '.rec'))
+        for op, pack in case.expected:
+            recorder.write('MO_V' + pack, 0.)
+        recorder.close()
+
+
+def load_corpus(directory):
+    '''
+    Returns the CorpusCases written to directory by write_corpus.
+    '''
+
+    cases = []
+
+    for name in sorted(os.listdir(directory)):
+
+        if not name.endswith('.stream'):
+            continue
+
+        path = os.path.join(directory, name)
+
+        f = open(path, 'rb')
+        stream = f.read()
+        f.close()
+
+        expected = [(ord(packet[4]), packet[4:]) for recvTime, packet in \
+                    read_packets(path[:-len('.stream')] + '.rec')]
+
+        cases.append(CorpusCase(name[:-len('.stream')], stream, expected))
+
+    return cases
+
+
+if __name__ == '__main__':
+
+    directory = sys.argv[1] if len(sys.argv) > 1 else 'corpus'
+
+    cases = generate() + generate_small()
+
+    write_corpus(directory, cases)
+
+    for case in cases:
+        print('%-24s %9d bytes %6d packets' % (case.name, len(case.stream), case.frames()))
@@ -0,0 +1,119 @@
+'''
+mediaframe.py Timestamped video and audio frames from the Brookstone Rover 2.0,
+and a helper for pairing them.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+'''
+
+import collections
+import bisect
+
+
+class VideoFrame:
+    ''' A JPEG image streamed from Rover.  Times are seconds on the clock.py
+        monotonic clock:
+
+            --recvTime: when the socket read completing the frame returned
+            --parseTime: when the frame was cut out of the stream
+            --callbackTime: when delivery to listeners began
+
+        timestamp and frameId are the Rover's own counters from the MO_V
+        op 1 header.
+    '''
+
+    def __init__(self, jpegbytes, timestamp, frameId, recvTime, parseTime):
+
+        self.jpegbytes = jpegbytes
+        self.timestamp = timestamp
+        self.frameId = frameId
+        self.recvTime = recvTime
+        self.parseTime = parseTime
+        self.callbackTime = None
+
+    def latency(self):
+        ''' Returns seconds from receipt to the start of delivery.
+        '''
+        return self.callbackTime - self.recvTime
+
+
+class AudioFrame:
+    ''' A block of 320 PCM samples streamed from Rover, with the same times as
+        VideoFrame.  tick, serial and timestamp are the Rover's own counters
+        from the MO_V op 2 header.
+    '''
+
+    def __init__(self, pcmsamples, tick, serial, timestamp, recvTime, parseTime):
+
+        self.pcmsamples = pcmsamples
+        self.tick = tick
+        self.serial = serial
+        self.timestamp = timestamp
+        self.recvTime = recvTime
+        self.parseTime = parseTime
+        self.callbackTime = None
+
+    def latency(self):
+        ''' Returns seconds from receipt to the start of delivery.
+        '''
+        return self.callbackTime - self.recvTime
+
+
+class AVAligner:
+
+    def __init__(self, history=250):
+        ''' Creates an aligner holding the last history audio frames, for
+            pairing with video frames by receive time.
+        '''
+
+        self._frames = collections.deque(maxlen=history)
+
+    def addAudio(self, frame):
+        ''' Records an AudioFrame.
+        '''
+        self._frames.append(frame)
+
+    def audioFor(self, videoframe, before=0.25, after=0.):
+        ''' Returns the recorded AudioFrames received from before seconds
+            ahead of the VideoFrame to after seconds following it, oldest first.
+        '''
+
+        frames = list(self._frames)
+
+        times = [frame.recvTime for frame in frames]
+
+        lo = bisect.bisect_left(times, videoframe.recvTime - before)
+        hi = bisect.bisect_right(times, videoframe.recvTime + after)
+
+        return frames[lo:hi]
+
+    def samplesFor(self, videoframe, before=0.25, after=0.):
+        ''' Returns the PCM samples of audioFor() as one list.
+        '''
+
+        samples = []
+
+        for frame in self.audioFor(videoframe, before, after):
+            samples.extend(frame.pcmsamples)
+
+        return samples
+
+    def skew(self, videoframe):
+        ''' Returns seconds by which the nearest recorded audio frame was
+            received after the VideoFrame (negative if before), or None if no
+            audio has been recorded.
+        '''
+
+        if not self._frames:
+            return None
+
+        nearest = min(self._frames, key=lambda f: abs(f.recvTime - videoframe.recvTime))
+
+        return nearest.recvTime - videoframe.recvTime
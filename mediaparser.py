@@ -0,0 +1,261 @@
+'''
+mediaparser.py Cut the video and audio packets streamed by the Brookstone
+Rover 2.0 out of the raw bytes of its media connection.
+
+The parser knows nothing of sockets, so it serves the live session, recorded
+sessions and offline tools alike.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+'''
+
+import bisect
+
+from adpcm import decodeADPCMToPCM
+from byteutils import bytes_to_int
+from clock import monotonic
+from headers import VIDEO, AUDIO, HEADER, VIDEO_SUBHEADER, AUDIO_SUBHEADER, ADPCM_TRAILER
+from mediaframe import VideoFrame, AudioFrame
+from metrics import MetricsRegistry
+
+# Where the sub-header and ADPCM trailer sit in a packet cut without its marker
+_SUBHEADER = HEADER.size - 4
+_TRAILER = _SUBHEADER + AUDIO_SUBHEADER.size + 160
+
+
+def video_frame(pack, recvTime):
+    '''
+    Returns a mediaframe.VideoFrame for an op 1 packet, as cut by MediaParser
+    (without its MO_V marker).
+    '''
+
+    timestamp, frameId, length = VIDEO_SUBHEADER.unpack_from(pack, _SUBHEADER)
+
+    return VideoFrame(pack[32:32+length],
+                      timestamp,
+                      frameId,
+                      recvTime,
+                      monotonic())
+
+
+def audio_frame(pack, recvTime):
+    '''
+    Returns a mediaframe.AudioFrame for an op 2 packet, as cut by MediaParser
+    (without its MO_V marker), decoding its ADPCM to PCM.
+    '''
+
+    tick, serial, timestamp, length = AUDIO_SUBHEADER.unpack_from(pack, _SUBHEADER)
+    offset, index = ADPCM_TRAILER.unpack_from(pack, _TRAILER)
+
+    return AudioFrame(decodeADPCMToPCM(pack[36:196], offset, index),
+                      tick,
+                      serial,
+                      timestamp,
+                      recvTime,
+                      monotonic())
+
+
+class MediaParser:
+
+    def __init__(self, metrics=None, maxPacket=1048576):
+        ''' Creates a parser that cuts each packet at the length given in its
+            header, accepting it once the next MO_V marker is found where it
+            ends.  A JPEG frame that ends with its end-of-image marker is
+            accepted straight away, so as not to hold up video.  A packet
+            claiming more than maxPacket bytes, or any other packet followed
+            by anything but a marker, is dropped as truncated and the stream
+            resynchronized at the next marker.  Counts of packets, resyncs and
+            rejects go to the metrics.MetricsRegistry, if any.
+        '''
+
+        self.maxPacket = maxPacket
+
+        # Unparsed bytes, appended to in place, and how many of them there
+        # must be before parsing is worth trying again
+        self.backlog = bytearray()
+        self.needed = 0
+
+        # Bytes copied while buffering and cutting, for benchmarks
+        self.bytesCopied = 0
+
+        # Total bytes fed, and (end offset, time) of each recent feed, for
+        # finding when each packet's last byte arrived
+        self.received = 0
+        self.readEnds = []
+        self.readTimes = []
+
+        if metrics is None:
+            metrics = MetricsRegistry()
+
+        self.resyncs = metrics.counter('media.resyncs')
+        self.bytesSkipped = metrics.counter('media.bytes_skipped')
+        self.bufferBytes = metrics.gauge('media.buffer_bytes')
+        self.unknownPackets = metrics.counter('media.unknown_packets')
+        self.videoFrames = metrics.counter('video.frames_parsed')
+        self.videoDropped = metrics.counter('video.frames_bad_length')
+        self.audioPackets = metrics.counter('audio.packets_parsed')
+        self.audioDropped = metrics.counter('audio.packets_bad_length')
+
+    def feed(self, data, recvTime):
+        ''' Adds bytes read at recvTime and returns a list of (op, pack,
+            recvTime) for each complete, well-formed packet, where pack follows
+            the MO_V marker and recvTime is when its last byte arrived.  data
+            may be a string, bytearray or memoryview, such as a view of a
+            buffer read into and reused by the caller: its bytes are copied
+            once, to the end of the backlog, before feed() returns.
+        '''
+
+        self.received += len(data)
+        self.readEnds.append(self.received)
+        self.readTimes.append(recvTime)
+
+        self.backlog += data
+        self.bytesCopied += len(data)
+
+        # Scanning the backlog after every small read would be wasted effort
+        if len(self.backlog) < self.needed:
+            self.bufferBytes.set(len(self.backlog))
+            return []
+
+        return self._parse(False)
+
+    def flush(self):
+        ''' Returns, as for feed(), a final packet held back because nothing
+            has followed it, once the stream has ended.
+        '''
+        return self._parse(True)
+
+    # "Private" methods ========================================================
+
+    def _parse(self, final):
+
+        buf = self.backlog
+
+        # Packets are copied straight out of the backlog through this view
+        view = memoryview(buf)
+
+        packets = []
+
+        # Stream offset of the first byte of buf
+        base = self.received - len(buf)
+
+        pos = 0
+        size = len(buf)
+
+        self.needed = 0
+
+        while True:
+
+            if size - pos < 4:
+                break
+
+            if not buf.startswith('MO_V', pos):
+                pos = self._resync(buf, pos)
+                continue
+
+            # Need the header up to the audio length field
+            if size - pos < 40:
+                self.needed = 40 - (size - pos)
+                break
+
+            op = buf[pos+4]
+
+            if op == VIDEO:
+                length = bytes_to_int(buf, pos+32)
+                end = pos + 36 + length
+                dropped = self.videoDropped
+
+            elif op == AUDIO:
+                length = bytes_to_int(buf, pos+36)
+                end = pos + 43 + length
+                dropped = self.audioDropped
+
+            else:
+                self.unknownPackets.inc()
+                pos = self._resync(buf, pos+1)
+                continue
+
+            if end - pos > self.maxPacket:
+                dropped.inc()
+                pos = self._resync(buf, pos+1)
+                continue
+
+            if end > size:
+                self.needed = end - size
+                break
+
+            # A truncated packet runs into the next one, so no marker follows;
+            # but a JPEG frame that ends with its end-of-image marker is whole
+            following = min(size - end, 4)
+            wholeJPEG = op == VIDEO and buf.endswith('\xff\xd9', pos, end)
+
+            if following == 4 or final:
+                if not buf.startswith('MO_V'[:following], end) and not wholeJPEG:
+                    dropped.inc()
+                    pos = self._resync(buf, pos+1)
+                    continue
+
+            elif following or not wholeJPEG:
+                self.needed = end + 4 - size
+                break
+
+            if op == VIDEO:
+                self.videoFrames.inc()
+            else:
+                self.audioPackets.inc()
+
+            pack = view[pos+4:end].tobytes()
+            self.bytesCopied += len(pack)
+
+            packets.append((op, pack, self._recvTime(base+end)))
+
+            pos = end
+
+        # The backlog cannot be resized while viewed
+        del view
+
+        # Move what is left to the front of the backlog
+        if pos:
+            del buf[:pos]
+            self.bytesCopied += len(buf)
+
+        self.needed += len(buf)
+
+        # Forget feeds whose bytes have all been parsed
+        self._trimReads(self.received - len(buf))
+
+        self.bufferBytes.set(len(buf))
+
+        return packets
+
+    def _resync(self, buf, pos):
+
+        k = buf.find('MO_V', pos)
+
+        # Keep a possible partial marker at the end
+        if k < 0:
+            k = max(pos, len(buf)-3)
+
+        if k > pos:
+            self.resyncs.inc()
+            self.bytesSkipped.inc(k-pos)
+
+        return k
+
+    def _recvTime(self, end):
+
+        return self.readTimes[bisect.bisect_left(self.readEnds, end)]
+
+    def _trimReads(self, start):
+
+        n = bisect.bisect_right(self.readEnds, start)
+
+        del self.readEnds[:n]
+        del self.readTimes[:n]
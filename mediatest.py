@@ -8,37 +8,22 @@ import numpy as np
 import time
 
 
-# Try to start OpenCV for video
+# Try to start OpenCV for video, shown on its own thread
 try:
-    import cv2
+    from display import FrameDisplay
+    display = FrameDisplay('Rover 2.0', (640, 480))
+    display.start()
 except:
-    cv2 = None
+    display = None
 
 # Handler passed to Rover constructor
 class MediaRover(rover.Rover):
             
-    def processVideo(self, jpegbytes):
-                            
-        try:
-                    
-            if cv2:
-                
-                ts=time.time();
-                wname = 'Rover 2.0'
-                nparr = np.fromstring(jpegbytes, np.uint8)
-                img_np = cv2.imdecode(nparr, cv2.CV_LOAD_IMAGE_COLOR)
-                cv2.namedWindow(wname, cv2.WINDOW_NORMAL)
-                cv2.resizeWindow(wname, 640, 480)
-                cv2.imshow(wname,img_np)
-                cv2.waitKey(5)
-                
-            else:
-                pass
-            
-        except:
-            info=sys.exc_info()  
-            print info[0],":",info[1]
-            pass
+    def processVideoFrame(self, frame):
+        
+        # Hand the frame off without waiting for it to be drawn
+        if display:
+            display.submitFrame(frame)
             
 rover = MediaRover()
 
@@ -52,8 +37,5 @@ elif a=='t':
     
     rover.startTalk(rover.MEDIA_PASS)
 
-while True:
-    pass
-
-# Shut down Rover
-rover.close()
\ No newline at end of file
+# Idle till the session ends or CTRL-C is hit
+rover.run_until_closed()
@@ -0,0 +1,190 @@
+'''
+metrics.py Low-overhead counters, gauges and latency histograms for the
+Brookstone Rover 2.0 pipelines.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+'''
+
+import bisect
+import json
+import socket
+import threading
+import time
+
+# Upper bounds, in milliseconds, of the default latency histogram buckets
+LATENCY_BUCKETS_MS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000]
+
+
+class Counter:
+    ''' A count that only goes up.  Updates are not locked, so each counter
+        should be incremented from a single thread.
+    '''
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge:
+    ''' A value that is set rather than accumulated.
+    '''
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def snapshot(self):
+        return self.value
+
+
+class Histogram:
+    ''' Counts observations into fixed buckets; the last bucket holds values
+        above the largest bound.
+    '''
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets)+1)
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        ''' Returns the upper bound of the bucket holding the q'th quantile,
+            or the maximum seen if that lies above every bound.
+        '''
+
+        if not self.count:
+            return 0.
+
+        rank = q * self.count
+        seen = 0
+
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+
+        return self.max
+
+    def snapshot(self):
+        return {'count' : self.count,
+                'mean' : self.total / self.count if self.count else 0.,
+                'max' : self.max,
+                'p50' : self.quantile(.5),
+                'p99' : self.quantile(.99),
+                'buckets' : self.buckets,
+                'counts' : list(self.counts)}
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        ''' Creates an empty registry.  Metrics are created on first use of
+            their name and live for the life of the registry.
+        '''
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name):
+        ''' Returns the Counter with the specified name.
+        '''
+        return self._get(name, Counter)
+
+    def gauge(self, name):
+        ''' Returns the Gauge with the specified name.
+        '''
+        return self._get(name, Gauge)
+
+    def histogram(self, name, buckets=LATENCY_BUCKETS_MS):
+        ''' Returns the Histogram with the specified name.
+        '''
+        return self._get(name, Histogram, buckets)
+
+    def snapshot(self):
+        ''' Returns a dictionary mapping each metric name to its current value.
+        '''
+        with self._lock:
+            metrics = list(self._metrics.items())
+        return dict((name, metric.snapshot()) for name, metric in metrics)
+
+    def _get(self, name, cls, *args):
+
+        metric = self._metrics.get(name)
+
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(name)
+                if metric is None:
+                    metric = cls(*args)
+                    self._metrics[name] = metric
+
+        return metric
+
+
+class MetricsExporter(threading.Thread):
+
+    def __init__(self, registry, path=None, address=None, periodSec=10):
+        ''' Creates a daemon thread that every periodSec seconds appends a
+            snapshot of the registry, as one line of JSON, to the file at path
+            and/or sends it as a UDP datagram to the (host, port) address.
+        '''
+
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        self.registry = registry
+        self.path = path
+        self.address = address
+        self.periodSec = periodSec
+
+        self._stopped = threading.Event()
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) if address else None
+
+    def stop(self):
+        ''' Stops exporting after one final snapshot.
+        '''
+        self._stopped.set()
+
+    def run(self):
+
+        while not self._stopped.wait(self.periodSec):
+            self._export()
+
+        self._export()
+
+    def _export(self):
+
+        line = json.dumps({'time' : time.time(), 'metrics' : self.registry.snapshot()})
+
+        if self.path:
+            with open(self.path, 'a') as f:
+                f.write(line + '\n')
+
+        if self._sock:
+            try:
+                self._sock.sendto(line.encode('utf-8'), self.address)
+            except socket.error:
+                pass
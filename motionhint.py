@@ -0,0 +1,151 @@
+'''
+motionhint.py Cheap motion detection on video from the Brookstone Rover 2.0,
+without decoding it.
+
+With the camera still, the size of each JPEG frame barely changes until
+something in the scene moves.  The detector keeps rolling statistics of
+frame sizes and fires 'motion' and 'still' events when a frame strays from
+them, so that costly vision code can sleep until it is needed.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+'''
+
+import collections
+import math
+
+from events import EventSource
+from framefilter import cv2, jpegbytes_to_thumbnail
+
+
+class MotionHintDetector(EventSource):
+
+    def __init__(self, onThreshold=4.0, offThreshold=None, alpha=0.05, warmup=30, \
+        minDeviation=0.01, stillFrames=15, history=250, useDC=False, dcThreshold=4.0, \
+        dcSize=(16,12)):
+        ''' Creates a detector that scores each JPEG frame passed to process()
+            by how many deviations its size lies from a running mean, kept with
+            smoothing factor alpha.  Deviations under minDeviation of the mean
+            are raised to it, so a perfectly steady stream is not oversensitive.
+            A 'motion' event fires when the score reaches onThreshold, and a
+            'still' event once it stays below offThreshold (default half of
+            onThreshold) for stillFrames frames.  No events fire during the
+            first warmup frames.  The last history sizes and scores are kept.
+
+            With useDC set and OpenCV available, each frame is also decoded at
+            1/8 scale, which needs only the DC coefficient of each 8x8 block,
+            and a frame whose dcSize greyscale image differs from the last by
+            dcThreshold grey levels on average also counts as motion.
+
+            Listeners added with addListener() are called back with each event
+            and the score on the thread calling process(); wait() waits for
+            'motion' by default.
+        '''
+
+        EventSource.__init__(self, ('motion', 'still'))
+
+        self.onThreshold = onThreshold
+        self.offThreshold = 0.5*onThreshold if offThreshold is None else offThreshold
+        self.alpha = alpha
+        self.warmup = warmup
+        self.minDeviation = minDeviation
+        self.stillFrames = stillFrames
+
+        self.useDC = useDC and cv2 is not None
+        self.dcThreshold = dcThreshold
+        self.dcSize = dcSize
+
+        self.isMoving = False
+        self.score = 0.
+        self.dcChange = 0.
+        self.mean = None
+        self.variance = 0.
+        self.frames = 0
+
+        self._sizes = collections.deque(maxlen=history)
+        self._scores = collections.deque(maxlen=history)
+        self._quiet = 0
+        self._lastDC = None
+
+    def recentSizes(self):
+        ''' Returns a list of recent frame sizes, oldest first.
+        '''
+        return list(self._sizes)
+
+    def recentScores(self):
+        ''' Returns a list of recent motion scores, oldest first.
+        '''
+        return list(self._scores)
+
+    def process(self, jpegbytes):
+        ''' Scores a JPEG frame and fires any resulting event.
+        '''
+
+        size = len(jpegbytes)
+
+        self.frames += 1
+        self._sizes.append(size)
+
+        if self.mean is None:
+            self.mean = float(size)
+
+        deviation = max(math.sqrt(self.variance), self.minDeviation*self.mean, 1.)
+
+        self.score = abs(size - self.mean) / deviation
+
+        moving = self.score >= self.onThreshold
+        quiet = self.score < self.offThreshold
+
+        if self.useDC:
+            self.dcChange = self._dcChange(jpegbytes)
+            if self.dcChange >= self.dcThreshold:
+                moving = True
+                quiet = False
+
+        self._scores.append(self.score)
+
+        # Learn slowly during motion, so that a lasting change of scene becomes
+        # the new normal without motion itself doing so straight away
+        alpha = self.alpha / 4 if self.isMoving else self.alpha
+        difference = size - self.mean
+        self.mean += alpha * difference
+        self.variance = (1-alpha) * (self.variance + alpha*difference*difference)
+
+        if self.frames <= self.warmup:
+            return
+
+        if moving:
+            self._quiet = 0
+            if not self.isMoving:
+                self.isMoving = True
+                self._fire(['motion'], self.score)
+
+        elif self.isMoving:
+            self._quiet = self._quiet + 1 if quiet else 0
+            if self._quiet >= self.stillFrames:
+                self.isMoving = False
+                self._fire(['still'], self.score)
+
+    # "Private" methods ========================================================
+
+    def _dcChange(self, jpegbytes):
+
+        thumbnail = jpegbytes_to_thumbnail(jpegbytes, self.dcSize)
+
+        if thumbnail is None:
+            return 0.
+
+        thumbnail = thumbnail.astype('float32')
+
+        change = 0. if self._lastDC is None else float(abs(thumbnail - self._lastDC).mean())
+
+        self._lastDC = thumbnail
+
+        return change
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+'''
+parserbench.py Measure how fast the media parser cuts packets out of the raw
+stream of the Brookstone Rover 2.0, at a range of read sizes.
+
+Each case of the stress corpus (generated, or loaded from a directory that
+mediacorpus.py wrote) is first checked against the packets it should yield,
+then fed repeatedly in chunks of each size, reporting packets and megabytes
+per second and how many bytes the parser copied per packet.
+
+Usage: parserbench.py [--corpus DIRECTORY] [--chunks 16,256,1460,8192,65536]
+                      [--repeat N] [--skip-verify]
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+'''
+
+import argparse
+import sys
+import timeit
+
+from mediacorpus import generate, generate_small, load_corpus, verify
+from mediaparser import MediaParser
+
+CHUNK_SIZES = (16, 256, 1460, 8192, 65536)
+
+
+def bench(stream, chunkSize, repeat=3):
+    '''
+    Feeds stream to a fresh MediaParser in chunks of chunkSize bytes, repeat
+    times, and returns (best seconds, packets, bytes copied) for one pass.
+    '''
+
+    # Cut the chunks up front so that only parsing is timed
+    chunks = [stream[k:k+chunkSize] for k in range(0, len(stream), chunkSize)]
+
+    best = None
+
+    for k in range(repeat):
+
+        parser = MediaParser()
+        packets = 0
+
+        start = timeit.default_timer()
+
+        for chunk in chunks:
+            packets += len(parser.feed(chunk, 0))
+        packets += len(parser.flush())
+
+        elapsed = timeit.default_timer() - start
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best, packets, parser.bytesCopied
+
+
+def run(cases, chunkSizes=CHUNK_SIZES, repeat=3):
+    '''
+    Benchmarks each case at each chunk size and returns a list of result
+    dictionaries.
+    '''
+
+    results = []
+
+    for case in cases:
+
+        for chunkSize in chunkSizes:
+
+            seconds, packets, copied = bench(case.stream, chunkSize, repeat)
+
+            seconds = max(seconds, 1e-9)
+
+            results.append({'case': case.name,
+                            'chunk': chunkSize,
+                            'seconds': seconds,
+                            'packets': packets,
+                            'packetsPerSec': packets / seconds,
+                            'mbPerSec': len(case.stream) / seconds / 1048576,
+                            'copiedPerPacket': float(copied) / max(packets, 1)})
+
+    return results
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark the Rover media parser.')
+    parser.add_argument('--corpus', metavar='DIR', help='corpus written by mediacorpus.py (default: generate one)')
+    parser.add_argument('--chunks', default=','.join(str(size) for size in CHUNK_SIZES), \
+                        help='comma-separated read sizes in bytes')
+    parser.add_argument('--repeat', type=int, default=3, help='passes per measurement; the best is kept')
+    parser.add_argument('--skip-verify', action='store_true', help='do not check the packets cut first')
+    args = parser.parse_args()
+
+    chunkSizes = [int(size) for size in args.chunks.split(',')]
+
+    cases = load_corpus(args.corpus) if args.corpus else generate()
+
+    if not args.skip_verify:
+
+        failures = verify(cases, chunkSizes, 0) + verify(generate_small(), ())
+
+        for name, description in failures:
+            print('FAILED %s: %s' % (name, description))
+
+        if failures:
+            sys.exit(1)
+
+    print('%-24s %7s %9s %10s %9s %12s' % ('case', 'chunk', 'packets', 'packets/s', 'MB/s', 'copied/pkt'))
+
+    for result in run(cases, chunkSizes, args.repeat):
+        print('%-24s %7d %9d %10.0f %9.1f %12.0f' % \
+              (result['case'], result['chunk'], result['packets'], result['packetsPerSec'], \
+               result['mbPerSec'], result['copiedPerPacket']))
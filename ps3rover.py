@@ -25,12 +25,15 @@ BUTTON_INFRARED =    1  # Circle button toggles infrared
 BUTTON_CAMERA_UP =   0  # Triangle button raises camera
 BUTTON_CAMERA_DOWN = 2  # X button lowers camera
 
-# Avoid button bounce by enforcing lag between button events
+# Avoid button bounce by enforcing lag between presses of each button
 MIN_BUTTON_LAG_SEC = 0.2
 
-# Avoid close-to-zero values on axis
+# Treat close-to-zero values on axis as zero
 MIN_AXIS_ABSVAL    = 0.01
 
+# Controller polling rate
+POLL_HZ            = 50
+
 
 import rover
 import cvutils
@@ -41,72 +44,37 @@ import signal
 import numpy as np
 import time
 
+from controlloop import ControlLoop
+
 def _signal_handler(signal, frame):
     frame.f_locals['rover'].close()
     sys.exit(0)
 
-# Try to start OpenCV for video
+# Try to start OpenCV for video, shown on its own thread
 try:
-    import cv2
+    from display import FrameDisplay
+    display = FrameDisplay('Rover 2.0', (640, 480))
+    display.start()
 except:
-    cv2 = None
+    display = None
 
 # Handler passed to Rover constructor
 class PS3Rover(rover.Rover):
             
-    def processVideo(self, jpegbytes):
-                            
-        try:
-                    
-            if cv2:
-                
-                ts=time.time()
-                print(ts)
-                wname = 'Rover 2.0'
-                nparr = np.fromstring(jpegbytes, np.uint8)
-                img_np = cv2.imdecode(nparr, cv2.CV_LOAD_IMAGE_COLOR)
-                cv2.namedWindow(wname, cv2.WINDOW_NORMAL)
-                cv2.resizeWindow(wname, 640, 480)
-                cv2.imshow(wname,img_np)
-                cv2.waitKey(5)
-                
-            else:
-                pass
-            
-        except:
-            info=sys.exc_info()  
-            print info[0],":",info[1]
-            pass
+    def processVideoFrame(self, frame):
         
+        # Hand the frame off without waiting for it to be drawn
+        if display:
+            display.submitFrame(frame)
         
-# Converts Y coordinate of specified axis to +/-1 or 0
-def _axis(index):
-    
-    value = -controller.get_axis(index)
+        
+# Reads a button on the controller
+def _button(buttonID):
+    return lambda: controller.get_button(buttonID)
     
-    if value > MIN_AXIS_ABSVAL:
-        return 1
-    elif value < -MIN_AXIS_ABSVAL:
-        return -1
-    else:
-        return 0
-
-
-# Handles button bounce by waiting a specified time between button presses   
-def _checkButton(controller, lastButtonTime, flag, buttonID, \
-    onRoutine=None, offRoutine=None):
-    if controller.get_button(buttonID):
-        if (time.time() - lastButtonTime) > MIN_BUTTON_LAG_SEC:
-            lastButtonTime = time.time()
-            if flag:
-                if offRoutine:
-                    offRoutine()
-                flag = False
-            else:
-                if onRoutine:
-                    onRoutine()
-                flag = True
-    return lastButtonTime, flag
+# Reads the Y coordinate of specified axis, + = forward
+def _axis(index):
+    return lambda: -controller.get_axis(index)
     
 
 # Set up controller using PyGame
@@ -119,51 +87,32 @@ controller.init()
 # Create a PS3 Rover object
 rover = PS3Rover()
 
-# Defaults on startup: lights off, ordinary camera
-lightsAreOn = False
-infraredIsOn = False
-
-# Tracks button-press times for debouncing
-lastButtonTime = 0
-
 # Set up signal handler for CTRL-C
 signal.signal(signal.SIGINT, _signal_handler)
 
-# Loop till Quit hit
-while True:
-        
-    # Force joystick polling
-    pygame.event.pump()    
-    
-    # Quit on Start button
-    if controller.get_button(BUTTON_QUIT):
-        break
-        
-    # Toggle lights    
-    lastButtonTime, lightsAreOn  = \
-        _checkButton(controller, lastButtonTime,  \
-            lightsAreOn, BUTTON_LIGHTS, rover.turnLightsOn, rover.turnLightsOff)   
-        
-    # Toggle night vision (infrared camera)    
-    lastButtonTime, infraredIsOn = \
-        _checkButton(controller, lastButtonTime, \
-            infraredIsOn, BUTTON_INFRARED, rover.turnInfraredOn, rover.turnInfraredOff)   
-        
-    # Move camera up/down    
-    if controller.get_button(BUTTON_CAMERA_UP):  
-        rover.moveCamera(1)
-    elif controller.get_button(BUTTON_CAMERA_DOWN): 
-        rover.moveCamera(-1)
-    else:
-        rover.moveCamera(0)
-        
-        
-    # Set treads based on axes        
-    rover.setTreads(_axis(1), _axis(3))
-                
-# Shut down Rover
-rover.close()
+# Sample the controller at a fixed rate, sending only changed setpoints
+loop = ControlLoop(rover, POLL_HZ, MIN_AXIS_ABSVAL)
+
+# Force joystick polling
+loop.setPump(pygame.event.pump)
 
+# Quit on Start button
+loop.setQuitButton(_button(BUTTON_QUIT))
 
+# Toggle lights and night vision (infrared camera); both off on startup
+loop.addToggle(_button(BUTTON_LIGHTS), rover.turnLightsOn, rover.turnLightsOff, \
+    MIN_BUTTON_LAG_SEC)
+loop.addToggle(_button(BUTTON_INFRARED), rover.turnInfraredOn, rover.turnInfraredOff, \
+    MIN_BUTTON_LAG_SEC)
 
+# Move camera up/down
+loop.setCameraButtons(_button(BUTTON_CAMERA_UP), _button(BUTTON_CAMERA_DOWN))
 
+# Set treads proportionally to axes
+loop.setTreadAxes(_axis(1), _axis(3))
+
+# Loop till Quit hit
+loop.run()
+                
+# Shut down Rover
+rover.close()
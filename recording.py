@@ -0,0 +1,149 @@
+'''
+recording.py Record the media packets streamed by the Brookstone Rover 2.0 to
+a file, and read them back.
+
+A recording is an 8-byte magic string followed by one record per packet: the
+monotonic time its last byte was received (little-endian double), its length
+(little-endian uint32), then the packet itself, starting with its MO_V marker.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+'''
+
+import os
+import struct
+import threading
+
+MAGIC = b'RVREC001'
+
+# receive time, packet length
+RECORD = struct.Struct('<dI')
+
+
+class MediaRecorder:
+
+    def __init__(self, path, bufferSize=1048576):
+        ''' Creates a recording at path, buffering bufferSize bytes of writes.
+        '''
+
+        self.path = path
+
+        self.packets = 0
+        self.bytes = 0
+
+        self._file = open(path, 'wb', bufferSize)
+        self._file.write(MAGIC)
+        self._lock = threading.Lock()
+
+    def write(self, packet, recvTime):
+        ''' Appends a packet, starting with its MO_V marker, received at
+            recvTime.
+        '''
+
+        with self._lock:
+
+            if self._file is None:
+                return
+
+            self._file.write(RECORD.pack(recvTime, len(packet)))
+            self._file.write(packet)
+
+        self.packets += 1
+        self.bytes += len(packet)
+
+    def close(self):
+        ''' Flushes and closes the recording.
+        '''
+
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+
+def read_packets(path, start=None, end=None, bufferSize=1048576):
+    '''
+    Yields (recvTime, packet) for each record of the recording at path that
+    starts within the byte range [start..end), by default the whole file,
+    reading bufferSize bytes at a time.  A truncated final record is ignored.
+    '''
+
+    f = open(path, 'rb', bufferSize)
+
+    try:
+
+        _checkMagic(f, path)
+
+        if start:
+            f.seek(start)
+
+        while end is None or f.tell() < end:
+
+            header = f.read(RECORD.size)
+
+            if len(header) < RECORD.size:
+                break
+
+            recvTime, length = RECORD.unpack(header)
+
+            packet = f.read(length)
+
+            if len(packet) < length:
+                break
+
+            yield recvTime, packet
+
+    finally:
+        f.close()
+
+
+def shard_recording(path, shardBytes):
+    '''
+    Returns a list of (start, end) byte ranges that split the recording at path
+    into pieces of about shardBytes each, every one starting on a record, for
+    passing to read_packets.  Only the record headers are read.
+    '''
+
+    size = os.path.getsize(path)
+
+    shards = []
+
+    f = open(path, 'rb')
+
+    try:
+
+        _checkMagic(f, path)
+
+        start = offset = len(MAGIC)
+
+        while offset + RECORD.size <= size:
+
+            if offset - start >= shardBytes:
+                shards.append((start, offset))
+                start = offset
+
+            f.seek(offset)
+            recvTime, length = RECORD.unpack(f.read(RECORD.size))
+
+            offset += RECORD.size + length
+
+    finally:
+        f.close()
+
+    if offset > start:
+        shards.append((start, size))
+
+    return shards
+
+
+def _checkMagic(f, path):
+
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError('%s is not a Rover recording' % path)
@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+'''
+relay.py Re-serve video and audio from one Brookstone Rover 2.0 session to
+many viewers over local HTTP.
+
+The Rover's radio copes with about one media connection, so the relay holds
+that one session and fans it out:
+
+  /video   multipart MJPEG, the Rover's own JPEG frames, not re-encoded
+  /audio   chunked stream of 16-bit big-endian mono PCM (audio/L16) at the
+           Rover's own rate
+  /        a page showing the video
+
+Each viewer has its own bounded queue; a slow viewer skips to the newest
+frames rather than holding up the Rover or the other viewers.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+'''
+
+import array
+import collections
+import socket
+import sys
+import threading
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+
+from rover import Rover
+
+BOUNDARY = 'roverframe'
+
+INDEX_PAGE = b'''<html><head><title>Rover 2.0</title></head>
+<body style="margin:0;background:#000"><img src="/video" style="width:100%"></body>
+</html>
+'''
+
+
+class _ClientQueue:
+
+    def __init__(self, depth):
+
+        self.items = collections.deque(maxlen=depth)
+        self.dropped = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def put(self, item):
+
+        with self.condition:
+            if len(self.items) == self.items.maxlen:
+                self.dropped += 1
+            self.items.append(item)
+            self.condition.notify()
+
+    def get(self, timeout):
+
+        with self.condition:
+            if not self.items and not self.closed:
+                self.condition.wait(timeout)
+            if self.items:
+                return self.items.popleft()
+            return None
+
+    def close(self):
+
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _RelayHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+
+        path = self.path.split('?')[0]
+
+        if path == '/video':
+            self._serveVideo()
+
+        elif path == '/audio':
+            self._serveAudio()
+
+        elif path == '/':
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.send_header('Content-Length', str(len(INDEX_PAGE)))
+            self.end_headers()
+            self.wfile.write(INDEX_PAGE)
+
+        else:
+            self.send_error(404)
+
+    # Viewers come and go mid-stream; that is not an error worth reporting
+    def handle(self):
+
+        try:
+            BaseHTTPRequestHandler.handle(self)
+        except socket.error:
+            pass
+
+    def finish(self):
+
+        try:
+            BaseHTTPRequestHandler.finish(self)
+        except socket.error:
+            pass
+
+    def log_message(self, format, *args):
+
+        if self.server.relay.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def _serveVideo(self):
+
+        relay = self.server.relay
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=' + BOUNDARY)
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+
+        def send(jpegbytes):
+            self.wfile.write(('--%s\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n' % \
+                              (BOUNDARY, len(jpegbytes))).encode('ascii'))
+            self.wfile.write(jpegbytes)
+            self.wfile.write(b'\r\n')
+
+        relay._stream(relay._videoClients, relay.videoDepth, send)
+
+        self.close_connection = True
+
+    def _serveAudio(self):
+
+        relay = self.server.relay
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'audio/L16; rate=%d; channels=1' % relay.rover.AUDIO_RATE)
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        def send(pcmbytes):
+            self.wfile.write(('%x\r\n' % len(pcmbytes)).encode('ascii'))
+            self.wfile.write(pcmbytes)
+            self.wfile.write(b'\r\n')
+
+        relay._stream(relay._audioClients, relay.audioDepth, send)
+
+        # End the chunked body if the viewer is still there
+        try:
+            self.wfile.write(b'0\r\n\r\n')
+        except socket.error:
+            pass
+
+        self.close_connection = True
+
+
+class MediaRelay:
+
+    def __init__(self, rover, address=('', 8080), videoDepth=2, audioDepth=25, verbose=False):
+        ''' Creates an HTTP server on (host, port) address that relays the
+            Rover's video and audio.  Each video viewer is sent from a queue of
+            at most videoDepth frames and each audio listener from one of at
+            most audioDepth blocks; the oldest are dropped when a queue is full.
+            Call start() to begin serving.
+        '''
+
+        self.rover = rover
+        self.videoDepth = videoDepth
+        self.audioDepth = audioDepth
+        self.verbose = verbose
+
+        self.videoFrames = 0
+        self.audioBlocks = 0
+
+        self._videoClients = set()
+        self._audioClients = set()
+        self._lock = threading.Lock()
+
+        self.server = _ThreadingHTTPServer(address, _RelayHandler)
+        self.server.relay = self
+
+        self._thread = None
+
+    def start(self):
+        ''' Starts serving on a daemon thread and relaying the Rover's media.
+        '''
+
+        self.rover.addVideoListener(self._onVideo)
+        self.rover.addAudioListener(self._onAudio)
+
+        self._thread = threading.Thread(target=self.server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        ''' Stops relaying, ends every viewer's stream and stops serving.
+        '''
+
+        self.rover.removeVideoListener(self._onVideo)
+        self.rover.removeAudioListener(self._onAudio)
+
+        with self._lock:
+            clients = list(self._videoClients) + list(self._audioClients)
+
+        for client in clients:
+            client.close()
+
+        self.server.shutdown()
+        self.server.server_close()
+
+    def viewers(self):
+        ''' Returns the number of video viewers and audio listeners connected.
+        '''
+        with self._lock:
+            return len(self._videoClients), len(self._audioClients)
+
+    def _onVideo(self, jpegbytes):
+
+        self.videoFrames += 1
+        self._fanOut(self._videoClients, jpegbytes)
+
+    def _onAudio(self, pcmsamples):
+
+        self.audioBlocks += 1
+
+        # Converted once for all listeners, to the network byte order of L16
+        samples = array.array('h', pcmsamples)
+        if sys.byteorder == 'little':
+            samples.byteswap()
+
+        self._fanOut(self._audioClients, \
+                     samples.tobytes() if hasattr(samples, 'tobytes') else samples.tostring())
+
+    def _fanOut(self, clients, item):
+
+        with self._lock:
+            clients = list(clients)
+
+        for client in clients:
+            client.put(item)
+
+    def _stream(self, clients, depth, send):
+
+        client = _ClientQueue(depth)
+
+        with self._lock:
+            clients.add(client)
+
+        try:
+            while self.rover.is_active and not client.closed:
+                item = client.get(1.0)
+                if item is not None:
+                    send(item)
+
+        # Viewer went away
+        except socket.error:
+            pass
+
+        finally:
+            with self._lock:
+                clients.discard(client)
+
+
+if __name__ == '__main__':
+
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8080
+
+    rover = Rover(talk=False)
+
+    relay = MediaRelay(rover, ('', port))
+    relay.start()
+
+    print('Relaying Rover video at http://localhost:%d/video' % port)
+
+    # Idle till the session ends or CTRL-C is hit
+    rover.run_until_closed()
+
+    relay.close()
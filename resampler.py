@@ -0,0 +1,141 @@
+'''
+resampler.py Streaming polyphase resampling of audio from the Brookstone
+Rover 2.0, which is sampled at 8192 Hz, to rates other tools expect.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+'''
+
+import numpy as np
+
+
+def _gcd(a, b):
+
+    while b:
+        a, b = b, a % b
+
+    return a
+
+
+def polyphase_filter(up, down, taps=24, beta=8.0):
+    '''
+    Returns the (up, taps) polyphase decomposition of a Kaiser-windowed sinc
+    low-pass filter for resampling by up/down, with a gain of up so that the
+    zero-stuffed signal keeps its level.
+    '''
+
+    length = taps * up
+
+    # Cut off just below the lower of the two Nyquist frequencies
+    cutoff = 0.5 / max(up, down) * 0.92
+
+    n = np.arange(length) - (length - 1) / 2.
+
+    h = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(length, beta)
+
+    h *= up / h.sum()
+
+    # Row p holds taps p, p+up, p+2*up, ...
+    return h.reshape(taps, up).T.copy()
+
+
+class PolyphaseResampler:
+
+    def __init__(self, inRate=8192, outRate=16000, taps=24):
+        ''' Creates a resampler from inRate to outRate Hz using a filter of
+            taps taps per phase.  Filter history and phase carry over from one
+            block to the next, so a stream may be fed in blocks of any size.
+        '''
+
+        divisor = _gcd(inRate, outRate)
+
+        self.inRate = inRate
+        self.outRate = outRate
+        self.up = outRate // divisor
+        self.down = inRate // divisor
+        self.taps = taps
+
+        self._filter = polyphase_filter(self.up, self.down, taps)
+        self._tapIndex = np.arange(taps-1, -1, -1)
+
+        # Last taps-1 inputs, and the position of the next output on the
+        # upsampled time line, counted from the start of the next block
+        self._history = np.zeros(taps-1)
+        self._position = 0
+
+    def process(self, block):
+        ''' Resamples a block of samples (list, int16 or float32 NumPy array)
+            and returns the output samples it completes, as int16 unless the
+            block was floating point, in which case as float32.
+        '''
+
+        block = np.asarray(block)
+
+        floating = block.dtype.kind == 'f'
+
+        samples = np.concatenate((self._history, block.astype(np.float64)))
+
+        span = len(block) * self.up
+
+        count = max(0, (span - self._position + self.down - 1) // self.down)
+
+        positions = self._position + self.down * np.arange(count)
+
+        inputs = positions // self.up
+        phases = positions % self.up
+
+        # Each output is the dot product of its phase's taps with the inputs
+        # leading up to it
+        window = samples[inputs[:, np.newaxis] + self._tapIndex[np.newaxis, :]]
+        output = np.einsum('ij,ij->i', window, self._filter[phases])
+
+        self._position += count * self.down - span
+        self._history = samples[len(samples)-(self.taps-1):]
+
+        if floating:
+            return output.astype(np.float32)
+
+        return np.clip(np.round(output), -32768, 32767).astype(np.int16)
+
+
+class SharedResampler:
+
+    def __init__(self, inRate, outRate, taps=24):
+        ''' Resamples a stream once from inRate to outRate Hz for any number of
+            subscribers.
+        '''
+
+        self.resampler = PolyphaseResampler(inRate, outRate, taps)
+
+        self._listeners = ()
+
+    def subscribe(self, callback):
+        ''' Registers callback(samples) to be called with each resampled block.
+        '''
+        self._listeners = self._listeners + (callback,)
+
+    def unsubscribe(self, callback):
+        ''' Unregisters a callback added with subscribe().
+        '''
+        self._listeners = tuple(c for c in self._listeners if c != callback)
+
+    def subscribers(self):
+        ''' Returns the number of subscribers.
+        '''
+        return len(self._listeners)
+
+    def process(self, block):
+        ''' Resamples a block and passes the result to every subscriber.
+        '''
+
+        samples = self.resampler.process(block)
+
+        for callback in self._listeners:
+            callback(samples)
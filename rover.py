@@ -16,154 +16,182 @@ GNU General Public License for more details.
 
 import struct
 import threading
+import collections
 import socket
 import time
-import audioop
-import binascii
-import pyaudio
-import wave
-import sys
-import numpy
 
 from blowfish import Blowfish
 from adpcm import *
 from byteutils import *
+from clock import monotonic
+from mediaparser import MediaParser, VIDEO, video_frame, audio_frame
+from metrics import MetricsRegistry, MetricsExporter
+import transport
+from commandchannel import CommandChannel, STOP, CONTROL, NORMAL, BACKGROUND
 
     
 class Rover:
 
-    def __init__(self):
-        ''' Creates a Rover object that you can communicate with. 
+    def __init__(self, video=True, audio=True, talk=True, keepalive=True, pipelined=False):
+        ''' Creates a Rover object that you can communicate with.  By default
+            video, audio and talk are all started along with a keep-alive 
+            timer; pass False for the channels you do not need.  With all three
+            off, only the command connection is opened, which is all that
+            one-shot commands like getBatteryPercentage need.
+            
+            With pipelined set, independent bring-up steps overlap: the media
+            connection opens while logging in, and the video, audio and talk
+            start requests are sent together before their replies are read.
+            Either way, the seconds spent in each phase are kept in 
+            bringupTimes.
         '''
       
         self.HOST = '192.168.1.100'
         self.PORT = 80
         
-        TARGET_ID = 'AC13'
-        TARGET_PASSWORD = 'AC13'      
+        self.TARGET_ID = 'AC13'
+        self.TARGET_PASSWORD = 'AC13'      
+        
+        self.AUDIO_RATE = 8192
         
         self.TREAD_DELAY_SEC = 0.5
+        self.TREAD_HYSTERESIS = 0.3
         self.KEEPALIVE_PERIOD_SEC = 60
+        self.COMMAND_REPLY_TIMEOUT_SEC = 10
+        self.CLOSE_TIMEOUT_SEC = 2
         
-                            
-        # Create command socket connection to Rover      
-        self.commandsock = self._newSocket()
-        
-        # Send login request with four arbitrary numbers
-        self._sendCommandIntRequest(0, [0, 0, 0, 0])
-                
-        # Get login reply
-        reply = self._receiveCommandReply(82)
-                
-        # Extract Blowfish key from camera ID in reply
-        cameraID = reply[25:37].decode('utf-8')
-        key = TARGET_ID + ':' + cameraID + '-save-private:' + TARGET_PASSWORD
-        
-        # Extract Blowfish inputs from rest of reply
-        L1 = bytes_to_int(reply, 66)
-        R1 = bytes_to_int(reply, 70)
-        L2 = bytes_to_int(reply, 74)
-        R2 = bytes_to_int(reply, 78)
-        
-        # Make Blowfish cipher from key
-        bf = _RoverBlowfish(key)
-        
-        # Encrypt inputs from reply
-        L1,R1 = bf.encrypt(L1, R1)
-        L2,R2 = bf.encrypt(L2, R2)
-        
-        # Send encrypted reply to Rover
-        self._sendCommandIntRequest(2, [L1, R1, L2, R2])     
-        
-        # Ignore reply from Rover
-        self._receiveCommandReply(26)
+        # Channels to open, and how
+        self.video = video
+        self.audio = audio
+        self.talk = talk
+        self.keepalive = keepalive
+        self.pipelined = pipelined
         
-        # Start timer task for keep-alive message every 60 seconds
-        self._startKeepaliveTask()
+        # Counters, gauges and histograms for the media, command and talk paths
+        self.metrics = MetricsRegistry()
+        self.metricsExporter = None
         
-        # Set up treads
-        self.leftTread = _RoverTread(self, 4)
-        self.rightTread = _RoverTread(self, 1)
+        # Cached status readings, polled in the background once started
+        self.telemetry = None
         
-        # Set up camera position
-        self.cameraIsMoving = False
-                      
-        # Send video-start request
-        self._sendCommandByteRequest(4, [1])
+        # No adaptive frame rate control unless started
+        self.frameRateController = None
         
-        # Get reply from Rover
-        reply = self._receiveCommandReply(29)
-                                
-        # Create media socket connection to Rover      
-        self.mediasock = self._newSocket()
-
-        # Send video-start request based on last four bytes of reply
-        self._sendRequest(self.mediasock, 'V', 0, 4, map(ord, reply[25:]))
+        # Per-packet tracing and recording are off unless started
+        self.tracer = None
+        self.recorder = None
         
-        self.MEDIA_PASS = reply[25:]
+        # Socket options for each connection, and the settings the OS applied
+        self.transportProfiles = dict(transport.PROFILES)
+        self.transportSettings = {}
         
-        # Set the frame rate of the camera
-        #self._sendCommandByteRequest(7, [50])
+        # No video frame suppression by default
+        self.frameSuppressor = None
         
-        # Send audio-start request
-        self._sendCommandByteRequest(8, [1])
+        # No audio or motion analysis or extra media consumers by default
+        self.audioLevelDetector = None
+        self.motionHintDetector = None
+        self.avAligner = None
+        self.videoListeners = ()
+        self.audioListeners = ()
         
-        # Ignore audio-start reply
-        reply2 = self._receiveCommandReply(29)
-
+        # One resampler per output rate, shared by its listeners
+        self._resamplers = {}
         
+        # Serializes close() with itself and with re-arming the keep-alive 
+        # timer; the session number tells stale timers and waiters from 
+        # current ones
+        self._lifecycleLock = threading.Lock()
+        self._session = 0
         
-        # Receive video and audio on another thread until closed
-        self.is_active = True
-        self.reader_thread = _MediaThread(self)
-        self.reader_thread.start()
+        # Held while a session is brought up or closed
+        self._sessionLock = threading.RLock()
         
-        # Start the talk function
-        self.startTalk()
+        with self._sessionLock:
+            self._open()
         
         
     def startTalk(self):
         ''' Start rover's talk function.
         '''
         
-        # Send talk-start request
-        self._sendCommandByteRequest(11, [1])
-                
-        # Ignore talk-start reply
-        reply3 = self._receiveCommandReply(29)
+        # Send talk-start request, ignoring reply
+        reply3 = self._requestCommandReply(11, [1], 29)
         
         # Start talk thread
         self.talk_thread = _TalkThread(self)
         self.talk_thread.start()
         
     def endTalk(self):
+        ''' Stops sending talk data and ends rover's talk function.
+        '''
+        self._stopTalkThread()
+        self.talk_thread = None
         self._sendCommandByteRequest(13, [1])
         
-        
-    def close(self):
-        ''' Closes off commuincation with Rover.
+    def close(self, timeout=None):
+        ''' Closes off commuincation with Rover, stopping every worker thread
+            within timeout seconds (default CLOSE_TIMEOUT_SEC).  Returns True 
+            if they all stopped in time.  Calling close() again does nothing;
+            a session restart() is bringing up is closed once it is up.
         '''
+        return self._close(timeout, self._session)
         
-        # Stop moving treads
-        self.setTreads(0, 0)
-                
-        self.keepalive_timer.cancel()
+    def restart(self, timeout=None):
+        ''' Closes the session, if still open, and brings it up again on the 
+            same object, keeping handlers, listeners, detectors and metrics.
+            Telemetry, frame rate control and metrics export must be started
+            again.  Returns bringupTimes.
+        '''
+        with self._sessionLock:
+            self.close(timeout)
+            self.metrics.counter('session.restarts').inc()
+            self._open()
+            return self.bringupTimes
         
-        self.is_active = False
-        self.commandsock.close()
         
-        if self.mediasock:
-            self.mediasock.close()
-            
-    
+    def getTransportSettings(self):
+        ''' Returns a dictionary mapping each connection ('control', 'media') to
+            the socket options, timeouts and buffer sizes in effect for it.
+        '''
+        return dict(self.transportSettings)
         
     def getBatteryPercentage(self):
         ''' Returns percentage of battery remaining.
         '''
-        self._sendCommandByteRequest(251)
-        reply = self._receiveCommandReply(32)
+        reply = self._requestCommandReply(251, [], 32)
         return 15 * ord(reply[23])
         
+    def startTelemetry(self, intervalSec=30, ttlSec=None):
+        ''' Starts polling status readings (battery percentage as 'battery') 
+            every intervalSec seconds in the background.  Returns the 
+            telemetry.TelemetryPoller, whose get() serves cached readings with
+            their age and whose subscribe() reports changes.
+        '''
+        from telemetry import TelemetryPoller
+        self.telemetry = TelemetryPoller(self, intervalSec, ttlSec)
+        self.telemetry.start()
+        return self.telemetry
+        
+    def setFrameRate(self, fps):
+        ''' Sets the camera frame rate, in frames per second.
+        '''
+        self.frameRate = int(fps)
+        self._sendCommandByteRequest(7, [self.frameRate], CONTROL)
+        self.metrics.gauge('video.frame_rate').set(self.frameRate)
+        
+    def startFrameRateControl(self, minFps=5, maxFps=30, periodSec=1.0):
+        ''' Starts adjusting the camera frame rate within [minFps..maxFps]
+            every periodSec seconds, lowering it while video backs up and
+            raising it while handlers keep up.  Returns the 
+            framerate.FrameRateController, whose addDropCounter() also takes
+            into account frames that consumers like a display drop.
+        '''
+        from framerate import FrameRateController
+        self.frameRateController = FrameRateController(self, minFps, maxFps, periodSec)
+        self.frameRateController.start()
+        return self.frameRateController
+        
     def moveCamera(self, where):
         ''' Moves the camera up or down, or stops moving it.  A nonzero value for the 
             where parameter causes the camera to move up (+) or down (-).  A
@@ -226,14 +254,587 @@ class Rover:
             interesting.
         '''
         pass        
+        
+    def processVideoFrame(self, frame):
+        ''' Proccesses a mediaframe.VideoFrame, which carries the JPEG bytes 
+            along with Rover's header counters and monotonic receive, parse and
+            callback times.  Default method passes the bytes to processVideo.
+        '''
+        self.processVideo(frame.jpegbytes)
+        
+    def processAudioFrame(self, frame):
+        ''' Proccesses a mediaframe.AudioFrame, which carries the PCM samples 
+            along with Rover's header counters and monotonic receive, parse and
+            callback times.  Default method passes the samples to processAudio.
+        '''
+        self.processAudio(frame.pcmsamples)
+        
+    def wait_closed(self, timeout=None):
+        ''' Blocks until the session is closed or its media stream ends.  
+            Returns True if it did, False if timeout seconds elapsed first.
+        '''
+        return self._closedEvent.wait(timeout)
+        
+    def run_until_closed(self):
+        ''' Idles until the session ends, closing it on CTRL-C.
+        '''
+        
+        # Only this session is ours to close, should restart() replace it
+        session = self._session
+        closedEvent = self._closedEvent
+        
+        # Wake periodically so that CTRL-C is noticed
+        try:
+            while not closedEvent.wait(0.5):
+                pass
+        except KeyboardInterrupt:
+            pass
+            
+        self._close(None, session)
+        
+    def wait_for_audio_event(self, event='loud', timeout=None):
+        ''' Blocks until the audio level detector reports the specified event
+            ('loud', 'quiet', 'voice' or 'silence'), installing a detector with
+            default settings if none has been set.  Returns True if the event 
+            occurred, False if timeout seconds elapsed first.
+        '''
+        if not self.audioLevelDetector:
+            from audiolevel import AudioLevelDetector
+            self.setAudioLevelDetector(AudioLevelDetector(vad=True))
+        return self.audioLevelDetector.wait(event, timeout)
+        
+    def wait_for_motion(self, timeout=None):
+        ''' Blocks until the video shows motion, judged from frame sizes
+            without decoding.  Returns True if it did, False if timeout seconds
+            elapsed first.  Installs a default motionhint.MotionHintDetector
+            if none has been set.
+        '''
+        if not self.motionHintDetector:
+            from motionhint import MotionHintDetector
+            self.setMotionHintDetector(MotionHintDetector())
+        return self.motionHintDetector.wait('motion', timeout)
+        
+    def iter_video_frames(self, timeout=None):
+        ''' Yields JPEG bytes for each new video frame, blocking between frames
+            and skipping frames that arrive while the caller is busy.  Stops 
+            when the session closes or no frame arrives within timeout seconds.
+        '''
+        return self._videoSlot.iterate(timeout)
+        
+    def iter_audio_blocks(self, timeout=None):
+        ''' Yields each block of PCM samples, blocking between blocks.  Up to 
+            50 blocks are held for a slow caller before the oldest are skipped.
+            Stops when the session closes or no block arrives within timeout 
+            seconds.
+        '''
+        return self._audioSlot.iterate(timeout)
+        
+    def stats(self):
+        ''' Returns a dictionary mapping each metric name to its current value.
+        '''
+        return self.metrics.snapshot()
+        
+    def startMetricsExporter(self, path=None, address=None, periodSec=10):
+        ''' Starts writing a JSON snapshot of stats() every periodSec seconds
+            to the file at path and/or as a UDP datagram to (host, port) 
+            address, until closed.
+        '''
+        self.metricsExporter = MetricsExporter(self.metrics, path, address, periodSec)
+        self.metricsExporter.start()
+        
+    def startTracing(self, capacity=100000):
+        ''' Starts recording per-packet timing spans (socket reads, buffering,
+            ADPCM decode, handoff, listeners and processVideo/processAudio) in
+            a ring buffer of capacity events.  Returns the tracing.Tracer.
+        '''
+        from tracing import Tracer
+        self.tracer = Tracer(capacity)
+        return self.tracer
+        
+    def stopTracing(self):
+        ''' Stops recording spans.  Returns the tracing.Tracer, which still 
+            holds the events recorded so far, or None if tracing was off.
+        '''
+        tracer = self.tracer
+        self.tracer = None
+        return tracer
+        
+    def dumpTrace(self, path):
+        ''' Writes the spans recorded since tracing started to path as Chrome /
+            Perfetto trace JSON.
+        '''
+        if self.tracer:
+            self.tracer.dump(path)
+        
+    def startRecording(self, path):
+        ''' Starts recording every media packet, with its receive time, to a
+            file at path that recording.read_packets can read back.  Returns 
+            the recording.MediaRecorder.
+        '''
+        from recording import MediaRecorder
+        self.recorder = MediaRecorder(path)
+        return self.recorder
+        
+    def stopRecording(self):
+        ''' Stops recording and closes the file.
+        '''
+        recorder = self.recorder
+        self.recorder = None
+        if recorder:
+            recorder.close()
+        
+    def setFrameSuppressor(self, suppressor):
+        ''' Installs a framefilter.FrameSuppressor that decides which video 
+            frames reach processVideo.  None delivers every frame.
+        '''
+        self.frameSuppressor = suppressor
+        
+    def setAudioLevelDetector(self, detector):
+        ''' Installs an audiolevel.AudioLevelDetector that measures every block
+            of audio before it reaches processAudio.  None removes it.
+        '''
+        self.audioLevelDetector = detector
+        
+    def setMotionHintDetector(self, detector):
+        ''' Installs a motionhint.MotionHintDetector that scores every video
+            frame, including those the frame suppressor drops, before it 
+            reaches processVideo.  None removes it.
+        '''
+        self.motionHintDetector = detector
+        
+    def setAVAligner(self, aligner):
+        ''' Installs a mediaframe.AVAligner that records every audio frame, so
+            that processVideoFrame can look up the audio received around each
+            video frame.  None removes it.
+        '''
+        self.avAligner = aligner
+        
+    def addVideoListener(self, callback):
+        ''' Registers callback(jpegbytes) to be called on the media thread for 
+            each video frame delivered, in addition to processVideo.
+        '''
+        self.videoListeners = self.videoListeners + (callback,)
+        
+    def removeVideoListener(self, callback):
+        ''' Unregisters a callback added with addVideoListener().
+        '''
+        self.videoListeners = tuple(c for c in self.videoListeners if c != callback)
+        
+    def addAudioListener(self, callback):
+        ''' Registers callback(pcmsamples) to be called on the media thread for
+            each block of audio, in addition to processAudio.
+        '''
+        self.audioListeners = self.audioListeners + (callback,)
+        
+    def removeAudioListener(self, callback):
+        ''' Unregisters a callback added with addAudioListener().
+        '''
+        self.audioListeners = tuple(c for c in self.audioListeners if c != callback)
+        
+    def addResampledAudioListener(self, rate, callback):
+        ''' Registers callback(samples) to be called with each block of audio
+            resampled from AUDIO_RATE to rate Hz, as a NumPy int16 array.
+            Listeners at the same rate share one resampler.
+        '''
+        shared = self._resamplers.get(rate)
+        if not shared:
+            from resampler import SharedResampler
+            shared = self._resamplers[rate] = SharedResampler(self.AUDIO_RATE, rate)
+            self.addAudioListener(shared.process)
+        shared.subscribe(callback)
+        
+    def removeResampledAudioListener(self, rate, callback):
+        ''' Unregisters a callback added with addResampledAudioListener().
+        '''
+        shared = self._resamplers.get(rate)
+        if shared:
+            shared.unsubscribe(callback)
+            if not shared.subscribers():
+                self.removeAudioListener(shared.process)
+                del self._resamplers[rate]
     
     # "Private" methods ========================================================
+    
+    def _close(self, timeout, session):
+        
+        # Waits out a bring-up in progress, and leaves alone a session that 
+        # has since been replaced by restart()
+        with self._sessionLock:
+            
+            with self._lifecycleLock:
+                if self._closed or session != self._session:
+                    return True
+                self._closed = True
+                
+            return self._stopSession(timeout)
+            
+    def _stopSession(self, timeout):
+        
+        closeStart = monotonic()
+        deadline = closeStart + (self.CLOSE_TIMEOUT_SEC if timeout is None else timeout)
+        
+        if self.commandChannel:
+        
+            # Stop moving treads, and talking, ahead of anything still queued
+            self.setTreads(0, 0)
+            if self.talk_thread:
+                self._sendCommandByteRequest(13, [1], STOP)
+                
+        self.is_active = False
+                
+        if self.keepalive_timer:
+            self.keepalive_timer.cancel()
+        
+        if self.metricsExporter:
+            self.metricsExporter.stop()
+            
+        if self.telemetry:
+            self.telemetry.stop()
+            
+        if self.frameRateController:
+            self.frameRateController.stop()
+            
+        self._stopTalkThread(None)
+        
+        if self.reader_thread:
+            self.reader_thread.stop()
+            
+        # Send the stops and whatever was queued before them, then stop sending;
+        # if the channel is still busy halfway to the deadline, shutting the
+        # socket down wakes it
+        if self.commandChannel:
+            self.commandChannel.close(self._remaining(deadline) / 2)
+            if self.commandChannel.is_alive():
+                self._shutdown(self.commandsock)
+            
+        # Wake the media thread from its read and the talk thread from its send
+        self._shutdown(self.mediasock)
+        
+        stopped = True
+        for worker in (self.commandChannel, self.reader_thread, self.talk_thread, \
+                       self.telemetry, self.frameRateController, self.metricsExporter):
+            stopped = self._joinBy(worker, deadline) and stopped
+            
+        self.stopRecording()
+        
+        for sock in (self.commandsock, self.mediasock):
+            if sock:
+                sock.close()
+            
+        # Wake anyone waiting on the session
+        self._closeWaiters()
+        
+        self.metrics.histogram('session.close_ms').observe(1000*(monotonic()-closeStart))
+        if not stopped:
+            self.metrics.counter('session.workers_left_running').inc()
+            
+        return stopped
+        
+    def _open(self):
+        
+        # Set up treads
+        self.leftTread = _RoverTread(self, 4)
+        self.rightTread = _RoverTread(self, 1)
+        
+        # Set up camera position
+        self.cameraIsMoving = False
+        
+        # Camera default frame rate until set
+        self.frameRate = None
+        
+        # Latest media for blocking iterators, and an event set on close
+        self._videoSlot = _MediaSlot(1)
+        self._audioSlot = _MediaSlot(50)
+        self._closedEvent = threading.Event()
+        
+        # Connections and workers not yet started
+        self.commandsock = None
+        self.mediasock = None
+        self.keepalive_timer = None
+        self.reader_thread = None
+        self.talk_thread = None
+        self.commandChannel = None
+        
+        # Starts True; set to False by close()
+        self.is_active = True
+        with self._lifecycleLock:
+            self._closed = False
+            self._session += 1
+        
+        self.bringupTimes = {}
+        bringupStart = monotonic()
+        
+        # Leave nothing half open if bring-up fails
+        try:
+            if self.pipelined and (self.video or self.audio or self.talk):
+                self._bringUpPipelined()
+            else:
+                self._bringUp()
+        except:
+            self.close(0)
+            raise
+            
+        self.bringupTimes['total'] = monotonic() - bringupStart
+        
+    def _stopTalkThread(self, timeout=1):
+        
+        if self.talk_thread:
+            self.talk_thread.stop()
+            self._joinBy(self.talk_thread, None if timeout is None else monotonic() + timeout)
+            
+    def _remaining(self, deadline):
+        
+        return max(0, deadline - monotonic())
+        
+    def _joinBy(self, worker, deadline):
+        
+        # A handler may close the session from a worker's own thread
+        if not worker or worker is threading.current_thread() or not worker.is_alive():
+            return True
+            
+        if deadline is not None:
+            worker.join(self._remaining(deadline))
+            
+        return not worker.is_alive()
+        
+    def _shutdown(self, sock):
+        
+        if sock:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
          
-    def _startKeepaliveTask(self,):
-        self._sendCommandByteRequest(255)
-        self.keepalive_timer = \
-            threading.Timer(self.KEEPALIVE_PERIOD_SEC, self._startKeepaliveTask, [])
-        self.keepalive_timer.start()
+    def _bringUp(self):
+        
+        self._login()
+        
+        self._startCommandChannel()
+        
+        # Start timer task for keep-alive message every 60 seconds
+        if self.keepalive:
+            self._startKeepaliveTask()
+            
+        if self.video or self.audio or self.talk:
+            self._startMedia()
+            
+    def _bringUpPipelined(self):
+        
+        # Open the media connection while logging in
+        connector = _Connector(self, 'media')
+        connector.start()
+        
+        try:
+            self._login()
+            self._startMediaPipelined(connector)
+            
+        # close() knows only of a media socket already taken from the connector
+        except:
+            if self.mediasock is None:
+                connector.discard()
+            raise
+        
+        self._startCommandChannel()
+        
+        if self.keepalive:
+            self._startKeepaliveTask()
+            
+    def _startCommandChannel(self):
+        
+        # From here on one thread writes all commands, most urgent first
+        self.commandChannel = CommandChannel(self.commandsock, \
+            self._receiveCommandReply, self.metrics)
+        self.commandChannel.start()
+        
+    def _login(self):
+        
+        start = monotonic()
+        
+        # Create command socket connection to Rover      
+        self.commandsock = self._newSocket()
+        
+        start = self._timePhase('connect', start)
+        
+        # Send login request with four arbitrary numbers
+        self._sendCommandIntRequest(0, [0, 0, 0, 0])
+                
+        # Get login reply
+        reply = self._receiveCommandReply(82)
+        
+        start = self._timePhase('login', start)
+                
+        # Extract Blowfish key from camera ID in reply
+        cameraID = reply[25:37].decode('utf-8')
+        key = self.TARGET_ID + ':' + cameraID + '-save-private:' + self.TARGET_PASSWORD
+        
+        # Extract Blowfish inputs from rest of reply
+        L1 = bytes_to_int(reply, 66)
+        R1 = bytes_to_int(reply, 70)
+        L2 = bytes_to_int(reply, 74)
+        R2 = bytes_to_int(reply, 78)
+        
+        # Make Blowfish cipher from key
+        bf = _RoverBlowfish(key)
+        
+        # Encrypt inputs from reply
+        L1,R1 = bf.encrypt(L1, R1)
+        L2,R2 = bf.encrypt(L2, R2)
+        
+        start = self._timePhase('keygen', start)
+        
+        # Send encrypted reply to Rover
+        self._sendCommandIntRequest(2, [L1, R1, L2, R2])     
+        
+        # Ignore reply from Rover
+        self._receiveCommandReply(26)
+        
+        self._timePhase('verify', start)
+        
+    def _startMedia(self):
+        
+        start = monotonic()
+                      
+        # Send video-start request and get reply; the reply carries the media
+        # socket credentials, so it is needed for audio and talk too
+        reply = self._requestCommandReply(4, [1], 29)
+        
+        start = self._timePhase('videoStart', start)
+                                
+        # Create media socket connection to Rover      
+        self.mediasock = self._newSocket('media')
+        
+        start = self._timePhase('mediaConnect', start)
+
+        # Send video-start request based on last four bytes of reply
+        self._sendRequest(self.mediasock, 'V', 0, 4, map(ord, reply[25:]))
+        
+        self.MEDIA_PASS = reply[25:]
+        
+        # The camera keeps its default frame rate until setFrameRate()
+        
+        if self.audio:
+        
+            # Send audio-start request, ignoring reply
+            reply2 = self._requestCommandReply(8, [1], 29)
+            
+            start = self._timePhase('audioStart', start)
+        
+        # Receive video and audio on another thread until closed; video flows
+        # once started even for talk alone, so must be drained all the same
+        self.reader_thread = _MediaThread(self)
+        self.reader_thread.start()
+        
+        # Start the talk function
+        if self.talk:
+            self.startTalk()
+            self._timePhase('talkStart', start)
+            
+    def _startMediaPipelined(self, connector):
+        
+        start = monotonic()
+        
+        # Send video-start, which carries the media socket credentials, 
+        # along with audio- and talk-start, then read their replies in order
+        ops = [4] + ([8] if self.audio else []) + ([11] if self.talk else [])
+        
+        self.commandsock.sendall(''.join([self._buildRequest('O', op, 1, [1]) for op in ops]))
+        
+        replies = [self._recvExactly(self.commandsock, 29) for op in ops]
+        reply = replies[0]
+        
+        start = self._timePhase('startRequests', start)
+        
+        # The media connection should be open by now
+        self.mediasock = connector.result()
+        self.bringupTimes['mediaConnect'] = connector.elapsed
+        
+        start = self._timePhase('mediaWait', start)
+        
+        # Send video-start request based on last four bytes of reply
+        self._sendRequest(self.mediasock, 'V', 0, 4, map(ord, reply[25:]))
+        
+        self.MEDIA_PASS = reply[25:]
+        
+        # Drained even for talk alone, as for _startMedia()
+        self.reader_thread = _MediaThread(self)
+        self.reader_thread.start()
+            
+        # Talk-start has been acknowledged already
+        if self.talk:
+            self.talk_thread = _TalkThread(self)
+            self.talk_thread.start()
+            
+    def _timePhase(self, name, start):
+        
+        now = monotonic()
+        self.bringupTimes[name] = now - start
+        return now
+    
+    def _startKeepaliveTask(self, session=None):
+        with self._lifecycleLock:
+            # A timer that fired as the session closed must not re-arm
+            if self._closed or session not in (None, self._session):
+                return
+            self._sendCommandByteRequest(255, [], BACKGROUND)
+            self.keepalive_timer = threading.Timer(self.KEEPALIVE_PERIOD_SEC, \
+                self._startKeepaliveTask, [self._session])
+            self.keepalive_timer.daemon = True
+            self.keepalive_timer.start()
+    
+    def _deliverVideo(self, frame):
+        jpegbytes = frame.jpegbytes
+        if self.motionHintDetector:
+            self.motionHintDetector.process(jpegbytes)
+        if self.frameSuppressor and not self.frameSuppressor.accept(jpegbytes):
+            self.metrics.counter('video.frames_suppressed').inc()
+            return
+        frame.callbackTime = monotonic()
+        for callback in self.videoListeners:
+            callback(jpegbytes)
+        self._videoSlot.publish(jpegbytes)
+        handlerStart = monotonic()
+        self.processVideoFrame(frame)
+        handlerEnd = monotonic()
+        self.metrics.counter('video.frames_delivered').inc()
+        self.metrics.histogram('video.latency_ms').observe(1000*frame.latency())
+        self.metrics.histogram('video.callback_ms').observe(1000*(handlerEnd-frame.callbackTime))
+        if self.tracer:
+            self._traceFrame(self.tracer, 'video', frame, handlerStart, handlerEnd, 
+                             {'frameId' : frame.frameId, 'bytes' : len(jpegbytes)})
+        
+    def _deliverAudio(self, frame):
+        pcmsamples = frame.pcmsamples
+        frame.callbackTime = monotonic()
+        if self.avAligner:
+            self.avAligner.addAudio(frame)
+        if self.audioLevelDetector:
+            self.audioLevelDetector.process(pcmsamples)
+        for callback in self.audioListeners:
+            callback(pcmsamples)
+        self._audioSlot.publish(pcmsamples)
+        handlerStart = monotonic()
+        self.processAudioFrame(frame)
+        handlerEnd = monotonic()
+        self.metrics.counter('audio.packets_delivered').inc()
+        self.metrics.histogram('audio.latency_ms').observe(1000*frame.latency())
+        self.metrics.histogram('audio.callback_ms').observe(1000*(handlerEnd-frame.callbackTime))
+        if self.tracer:
+            self._traceFrame(self.tracer, 'audio', frame, handlerStart, handlerEnd, 
+                             {'serial' : frame.serial})
+        
+    def _traceFrame(self, tracer, kind, frame, handlerStart, handlerEnd, args):
+        # recv -> parse: waiting for the buffering threshold, then splitting
+        tracer.span(kind + '.buffered', frame.recvTime, frame.parseTime, kind, args)
+        # parse -> callback: suppression and handoff to delivery
+        tracer.span(kind + '.handoff', frame.parseTime, frame.callbackTime, kind, args)
+        tracer.span(kind + '.listeners', frame.callbackTime, handlerStart, kind, args)
+        tracer.span(kind == 'video' and 'processVideo' or 'processAudio', 
+                    handlerStart, handlerEnd, kind, args)
+        
+    def _closeWaiters(self):
+        self._closedEvent.set()
+        self._videoSlot.close()
+        self._audioSlot.close()
     
     def _setLights(self, onoff):    
         self._sendDeviceControlRequest(onoff, 0)
@@ -243,17 +844,20 @@ class Rover:
         # 2: Right, backward
         # 4: Left, forward
         # 5: Left, backward        
-        self._sendDeviceControlRequest(wheeldir, speed) 
+        # Stops jump the command queue, replacing any move of the same tread
+        # still queued so that it cannot follow them
+        tread = 'left' if wheeldir >= 4 else 'right'
+        self._sendDeviceControlRequest(wheeldir, speed, STOP if speed == 0 else CONTROL, tread) 
     
         
-    def _sendDeviceControlRequest(self, a, b) : 
-        self._sendCommandByteRequest(250, [a,b])
+    def _sendDeviceControlRequest(self, a, b, priority=NORMAL, key=None) : 
+        self._sendCommandByteRequest(250, [a,b], priority, key)
 
     def _sendCameraRequest(self, request):
-        self._sendCommandByteRequest(14, [request]) 
+        self._sendCommandByteRequest(14, [request], CONTROL) 
     
-    def _sendCommandByteRequest(self, id, bytes=[]):
-        self._sendCommandRequest(id, len(bytes), bytes)
+    def _sendCommandByteRequest(self, id, bytes=[], priority=NORMAL, key=None):
+        self._sendCommandRequest(id, len(bytes), bytes, priority, key)
         
     def _sendCommandIntRequest(self, id, intvals):
         bytevals = []
@@ -262,24 +866,54 @@ class Rover:
                 bytevals.append(ord(c))
         self._sendCommandRequest(id, 4*len(intvals), bytevals)       
 
-    def _sendCommandRequest(self, id, n, contents):
-        self._sendRequest(self.commandsock, 'O', id, n, contents)
+    def _sendCommandRequest(self, id, n, contents, priority=NORMAL, key=None):
+        # Before the command channel starts, only the login thread sends
+        if self.commandChannel:
+            self.commandChannel.submit(self._buildRequest('O', id, n, contents), priority, 0, key)
+        else:
+            self._sendRequest(self.commandsock, 'O', id, n, contents)
+            
+    def _requestCommandReply(self, id, bytes, count, priority=NORMAL):
+        ticket = self.commandChannel.submit(\
+            self._buildRequest('O', id, len(bytes), bytes), priority, count)
+        if not ticket.wait(self.COMMAND_REPLY_TIMEOUT_SEC):
+            raise socket.timeout('no reply to command %d' % id)
+        if ticket.error:
+            raise ticket.error
+        if not ticket.reply:
+            raise socket.error('connection closed before reply to command %d' % id)
+        return ticket.reply
 
     def _sendRequest(self, sock, c, id, n, contents):                  
+        sock.send(self._buildRequest(c, id, n, contents))
+        
+    def _buildRequest(self, c, id, n, contents):
         bytes = [ord('M'), ord('O'), ord('_'), ord(c), id, \
         0, 0, 0, 0, 0, 0, 0, 0, 0, 0, n, 0, 0, 0, 0, 0, 0, 0]
         
         bytes.extend(contents)
-        request = ''.join(map(chr, bytes))
-        sock.send(request)
+        return ''.join(map(chr, bytes))
         
     def _receiveCommandReply(self, count):
         reply = self.commandsock.recv(count)
         return reply
         
-    def _newSocket(self):
-        sock = socket.socket()
-        sock.connect((self.HOST, self.PORT))
+    def _recvExactly(self, sock, count):
+        
+        # Replies sent back to back may arrive split or run together
+        chunks = []
+        while count:
+            chunk = sock.recv(count)
+            if not chunk:
+                raise socket.error('connection closed by Rover')
+            chunks.append(chunk)
+            count -= len(chunk)
+        return ''.join(chunks)
+        
+    def _newSocket(self, profile='control'):
+        sock, settings = transport.open_socket(self.HOST, self.PORT, \
+            self.transportProfiles[profile])
+        self.transportSettings[profile] = settings
         return sock
     
 # "Private" classes ===========================================================
@@ -294,6 +928,49 @@ class _RoverBlowfish(Blowfish):
 
         self._keygen(key, ORIG_P)
 
+# Opens a connection on its own thread, so that other bring-up work can go on
+class _Connector(threading.Thread):
+    
+    def __init__(self, rover, profile):
+        
+        threading.Thread.__init__(self)
+        self.daemon = True
+        
+        self.rover = rover
+        self.profile = profile
+        
+        self.sock = None
+        self.error = None
+        self.elapsed = None
+        
+    def run(self):
+        
+        start = monotonic()
+        
+        try:
+            self.sock = self.rover._newSocket(self.profile)
+        except Exception as e:
+            self.error = e
+            
+        self.elapsed = monotonic() - start
+        
+    def result(self):
+        
+        self.join()
+        
+        if self.error:
+            raise self.error
+            
+        return self.sock
+        
+    def discard(self):
+        
+        # Waits out the connection attempt, then closes what it opened
+        self.join()
+        
+        if self.sock:
+            self.sock.close()
+
 # A thread for sending talk data to the Rover
 class _TalkThread(threading.Thread):
     ''' This is a talk thread that can make the rover talk.
@@ -313,6 +990,20 @@ class _TalkThread(threading.Thread):
         
         threading.Thread.__init__(self)
         self.rover = rover                        
+        
+        # This session's socket, should the Rover be restarted meanwhile
+        self.sock = rover.mediasock
+        
+        self.packetsSent = rover.metrics.counter('talk.packets_sent')
+        self.sendErrors = rover.metrics.counter('talk.send_errors')
+        self.sendTimeouts = rover.metrics.counter('talk.send_timeouts')
+        
+        # Set by stop(); also cuts short the wait between packets
+        self._stopped = threading.Event()
+        
+    def stop(self):
+        
+        self._stopped.set()
           
     def run(self):
         
@@ -328,12 +1019,14 @@ class _TalkThread(threading.Thread):
         
         adpcm_str = adpcm_f.read()
         
+        adpcm_f.close()
+        
         adpcm_str_length = len(adpcm_str)
         
         final_request = ''
         
-        # Starts True; set to False by Rover.close()
-        while self.rover.is_active:
+        # Runs until Rover.close() or endTalk()
+        while not self._stopped.is_set():
             
             if wr_frame_pointer+163 > adpcm_str_length:
                 talk_string = ''.join(map(chr,[0]*163))
@@ -359,24 +1052,33 @@ class _TalkThread(threading.Thread):
 
             try:
             
-                self.rover.mediasock.send(request)
-                
-                psn = psn + 1
-            
-                ts = time.time()
-                
-                tick = tick + 40
+                self.sock.send(request)
                 
-                # Here, because the ADPCM data are pre-written, so it's 163
-                wr_frame_pointer = wr_frame_pointer + 163
+            # A stalled link fills the send buffer; try this packet again
+            except socket.timeout:
+                self.sendTimeouts.inc()
+                continue
                 
-                time.sleep(0.02)
-                      
             except:
                 
-                print('error')
+                # The media connection is gone, so every later send would fail
+                self.sendErrors.inc()
+                if not self._stopped.is_set():
+                    print('error')
+                break
+                
+            self.packetsSent.inc()
+            
+            psn = psn + 1
         
-        self.rover.endTalk()
+            ts = time.time()
+            
+            tick = tick + 40
+            
+            # Here, because the ADPCM data are pre-written, so it's 163
+            wr_frame_pointer = wr_frame_pointer + 163
+            
+            self._stopped.wait(0.02)
             
 
                 
@@ -389,67 +1091,130 @@ class _MediaThread(threading.Thread):
         
         self.rover = rover
         self.BUFSIZE = 1048576
-        self.buf = ''
-                        
+        
+        # This session's socket, should the Rover be restarted meanwhile
+        self.sock = rover.mediasock
+        
+        # Read into one preallocated buffer rather than a fresh 1 MB string
+        self.readbuf = bytearray(self.BUFSIZE)
+        self.readview = memoryview(self.readbuf)
+        
+        metrics = rover.metrics
+        self.parser = MediaParser(metrics)
+        self.bytesReceived = metrics.counter('media.bytes_received')
+        self.reads = metrics.counter('media.reads')
+        self.decodeTime = metrics.histogram('audio.decode_ms')
+        
+        # Set by stop(), which Rover.close() follows by shutting down the 
+        # socket to end a read in progress
+        self.stopped = False
+        
+    def stop(self):
+        
+        self.stopped = True
           
     def run(self):
                             
-        # Starts True; set to False by Rover.close()       
-        while self.rover.is_active:
+        # Runs until Rover.close() or the end of the stream
+        while not self.stopped:
+            
+            tracer = self.rover.tracer
             
-            # Grab bytes from rover, halting on failure            
+            # Grab bytes from rover, halting on failure; a read timeout just
+            # gives us a chance to notice close()
             try:
-                buf = self.rover.mediasock.recv(self.BUFSIZE)
+                recvStart = monotonic()
+                count = self.sock.recv_into(self.readbuf)
+                
+            except socket.timeout:
+                continue
                 
             except:
                 break
+                
+            # An empty read means the Rover closed the stream
+            if not count:
+                break
+                
+            recvEnd = monotonic()
             
+            if tracer:
+                tracer.span('recv', recvStart, recvEnd, 'socket', {'bytes' : count})
             
-            self.buf +=buf
+            self.bytesReceived.inc(count)
+            self.reads.inc()
             
-            if len(self.buf)>10000:
+            # The parser copies the bytes out of the read buffer itself
+            for op, pack, recvTime in self.parser.feed(self.readview[:count], recvEnd):
                 
-                k = self.buf.find('MO_V')
+                recorder = self.rover.recorder
+                if recorder:
+                    recorder.write('MO_V'+pack, recvTime)
                 
-                if k>=0:
-                    self.buf = self.buf[k:]
-                    
+                if op == VIDEO:
                     
-                    packs = self.buf.split('MO_V')
-                    packs_length = len(packs)
-                    pack_index = 0
-                    
-                    for pack in packs:
+                    # Video is always streamed, but may not be wanted
+                    if self.rover.video:
+                        self.rover._deliverVideo(video_frame(pack, recvTime))
                         
-                        if pack_index == packs_length-1:
-                            self.buf = 'MO_V'+pack
-                            break
-                            
-                        elif len(pack)>23:
-                            pack_op = ord(pack[0])
-                            
-                            if pack_op == 1:
-                                
-                                video_length = bytes_to_int(pack,28)
-                                video_actual_length = len(pack)-32
-                                
-                                if video_actual_length == video_length:
-                                    self.rover.processVideo(pack[32:32+video_length])
-                            
-                            elif pack_op == 2:
-                                
-                                audio_length = bytes_to_int(pack,32)
-                                audio_actual_length = len(pack)-36
-                                
-                                if audio_actual_length-3 == audio_length:
-                                
-                                    offset = bytes_to_short(pack, 196)
-                                    index  = ord(pack[198])
-                                    audiobytes = decodeADPCMToPCM(pack[36:196], offset, index)
-                                    self.rover.processAudio(audiobytes)
+                else:
+                    decodeStart = monotonic()
+                    frame = audio_frame(pack, recvTime)
+                    decodeEnd = monotonic()
+                    self.decodeTime.observe(1000*(decodeEnd-decodeStart))
+                    if tracer:
+                        tracer.span('audio.decode', decodeStart, decodeEnd, 'audio')
+                    self.rover._deliverAudio(frame)
+                        
+        # Wake anyone waiting for media that will not come; after close() has
+        # done so, the Rover may already be running a new session
+        if not self.stopped:
+            self.rover._closeWaiters()
+        
+# Holds the most recent media items for threads blocked waiting on them
+class _MediaSlot:
+    
+    def __init__(self, depth):
+        
+        self.items = collections.deque(maxlen=depth)
+        self.seq = 0
+        self.closed = False
+        self.condition = threading.Condition()
+        
+    def publish(self, item):
+        
+        with self.condition:
+            self.seq += 1
+            self.items.append((self.seq, item))
+            self.condition.notify_all()
+            
+    def close(self):
+        
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+            
+    def iterate(self, timeout):
+        
+        lastseq = self.seq
+        
+        while True:
+            
+            with self.condition:
+                
+                if self.seq == lastseq and not self.closed:
+                    self.condition.wait(timeout)
+                
+                ready = [item for item in self.items if item[0] > lastseq]
+                
+                if not ready:
+                    return
                     
-                        pack_index +=1
-
+                lastseq = ready[-1][0]
+                
+            for seq, item in ready:
+                yield item
+                
                 
 class _RoverTread:
     
@@ -459,6 +1224,7 @@ class _RoverTread:
         self.index = index
         self.isMoving = False
         self.startTime = 0
+        self.setpoint = None
 
     def update(self, value):
 
@@ -466,15 +1232,27 @@ class _RoverTread:
             if self.isMoving:
                 self.rover._spinWheels(self.index, 0)
                 self.isMoving = False
+                self.setpoint = None
         else:
             if value > 0:
                 wheel = self.index
             else:
                 wheel = self.index + 1
+            speed = abs(value)*10
+            # Hold the current speed till the value is well past a step boundary
+            if self.setpoint and self.setpoint[0] == wheel and \
+                abs(speed - self.setpoint[1]) < 0.5 + self.rover.TREAD_HYSTERESIS:
+                setpoint = self.setpoint
+            else:
+                setpoint = (wheel, int(round(speed)))
             currTime = time.time()
-            if (currTime - self.startTime) > self.rover.TREAD_DELAY_SEC:              
+            # Send changes of direction or speed at once; repeat the same 
+            # setpoint no more often than TREAD_DELAY_SEC
+            if setpoint != self.setpoint or \
+                (currTime - self.startTime) > self.rover.TREAD_DELAY_SEC:              
                 self.startTime = currTime
-                self.rover._spinWheels(wheel, int(round(abs(value)*10)))  
+                self.rover._spinWheels(*setpoint)  
                 self.isMoving = True
+                self.setpoint = setpoint
                 
         
\ No newline at end of file
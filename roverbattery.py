@@ -18,7 +18,8 @@ GNU General Public License for more details.
 
 import rover
         
-rover = rover.Rover()
+# Only the command connection is needed for one reading
+rover = rover.Rover(video=False, audio=False, talk=False, keepalive=False)
 
 print('Battery at %d%%' % rover.getBatteryPercentage())
 
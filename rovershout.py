@@ -25,32 +25,18 @@ FLEESEC     = 2.0
 import rover
 import time
 
+from audiolevel import AudioLevelDetector
 
-# Handler passed to Rover constructor
-class AudioRover(rover.Rover):
-    
-    def __init__(self):
-        rover.Rover.__init__(self)
-        self.heard = False
-            
-    def processAudio(self, pcmsamples):
-                            
-        avg = 0
-        
-        for sample in pcmsamples:
-            avg += abs(sample)
-            
-        if avg/len(pcmsamples) > NOISETHRESH:
-            self.heard = True
-           
  
-# Create a Rover object that can process audio
-rover = AudioRover()
+# Create a Rover object
+rover = rover.Rover()
 
+# Measure loudness as the mean absolute sample value
+detector = AudioLevelDetector(onThreshold=NOISETHRESH, metric='mean')
+rover.setAudioLevelDetector(detector)
 
-# Loop till a loud noise is heard
-while not rover.heard:
-    pass
+# Sleep till a loud noise is heard
+rover.wait_for_audio_event('loud')
         
 # Turn around for a specified duration
 rover.setTreads(-1,+1)
@@ -17,32 +17,22 @@ GNU General Public License for more details.
 '''
 
 import rover
-import pyaudio
 import wave
 import sys
 import time
 import signal
-import numpy
-import struct
+
+from audiosink import AudioPlaybackSink, pcm_to_bytes
 
 nchannels = 1
 sampwidth = 2 #Sample is 16 bits (2 bytes)
-framerate = 8000
-nframes = 320
+framerate = 16000 #Rover audio is 8192 Hz; resampled to a rate sound cards play
+nframes = 625
 WAVE_OUTPUT_FILENAME = "output.wav"
 
-p = pyaudio.PyAudio()
-
-# pyaudio.paInt16
+# Plays audio on PortAudio's own thread, behind a jitter buffer
+sink = AudioPlaybackSink(rate=framerate, blockSize=nframes)
 
-stream = p.open(format=pyaudio.paInt16,
-                channels=nchannels,
-                rate=framerate,
-                output=True,
-                frames_per_buffer = nframes)
-
-                
-                
 print("* recording")
 wf = wave.open(WAVE_OUTPUT_FILENAME, 'wb')
 wf.setnchannels(nchannels)
@@ -50,40 +40,26 @@ wf.setsampwidth(sampwidth)
 wf.setframerate(framerate)
 wf.setnframes(nframes)
 
-# Overwrite the processAudio function
-class AudioRover(rover.Rover):
-    
-    def __init__(self):
-        rover.Rover.__init__(self)
-            
-    def processAudio(self, pcmsamples):
-        
-        newdata = []
-        for x in pcmsamples:
-            newdata.append(struct.pack('<h',x))
+# Handle audio once resampled to our rate
+def processResampledAudio(samples):
         
-        data_string = ''.join(newdata)
-        stream.write(data_string)
+    data_string = pcm_to_bytes(samples)
         
-        # Save the audio to local data file
-        wf.writeframes(data_string)
+    # Output audio to your computer
+    sink.write(data_string)
         
-        # Output audio to your computer
-        stream.write(pcmsamples)
+    # Save the audio to local data file
+    wf.writeframes(data_string)
         
-rover = AudioRover()
-
-
-while True:
-    pass
-
+rover = rover.Rover()
 
+rover.addResampledAudioListener(framerate, processResampledAudio)
 
-# Shut down Rover
-rover.close()
 
+# Idle till the session ends or CTRL-C is hit, then shut down Rover
+rover.run_until_closed()
 
-stream.close()
+wf.close()
 
 # close PyAudio 
-p.terminate()
\ No newline at end of file
+sink.close()
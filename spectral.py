@@ -0,0 +1,216 @@
+'''
+spectral.py Streaming spectral analysis of audio from the Brookstone Rover 2.0.
+
+The analyzer gathers PCM blocks into overlapping windows in a preallocated
+buffer and transforms every window that is ready in one batched NumPy FFT,
+so that any number of subscribers share one spectrum, band energy and mel
+feature computation per window.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+'''
+
+import numpy as np
+
+from numpy.lib.stride_tricks import as_strided
+
+# Default band edges, in Hz
+BANDS = ((0, 250), (250, 500), (500, 1000), (1000, 2000), (2000, 4096))
+
+
+def hz_to_mel(hz):
+    '''
+    Converts frequencies in Hz to mels.
+    '''
+    return 2595. * np.log10(1. + np.asarray(hz, dtype=np.float64) / 700.)
+
+
+def mel_to_hz(mel):
+    '''
+    Converts mels to frequencies in Hz.
+    '''
+    return 700. * (10. ** (np.asarray(mel, dtype=np.float64) / 2595.) - 1.)
+
+
+def mel_filterbank(rate, windowSize, melBands, fmin=0., fmax=None):
+    '''
+    Returns a (melBands, windowSize//2+1) matrix of triangular filters, evenly
+    spaced on the mel scale between fmin and fmax (default: half the rate),
+    that maps a power spectrum to mel band energies.
+    '''
+
+    if fmax is None:
+        fmax = rate / 2.
+
+    bins = np.fft.rfftfreq(windowSize, 1. / rate)
+
+    edges = mel_to_hz(np.linspace(hz_to_mel(fmin), hz_to_mel(fmax), melBands+2))
+
+    lower = edges[:-2, np.newaxis]
+    center = edges[1:-1, np.newaxis]
+    upper = edges[2:, np.newaxis]
+
+    rising = (bins - lower) / (center - lower)
+    falling = (upper - bins) / (upper - center)
+
+    return np.maximum(0., np.minimum(rising, falling)).astype(np.float32)
+
+
+def band_matrix(rate, windowSize, bands):
+    '''
+    Returns a (len(bands), windowSize//2+1) matrix of ones and zeros that sums
+    a power spectrum over each (low, high) band in Hz.
+    '''
+
+    bins = np.fft.rfftfreq(windowSize, 1. / rate)
+
+    return np.array([(bins >= low) & (bins < high) for low, high in bands], dtype=np.float32)
+
+
+class SpectralFrame:
+    ''' The analysis of one window.  time is in seconds of audio since the
+        analyzer started, at the centre of the window.  power, bands and mel
+        are rows of the batch they were computed in.
+    '''
+
+    def __init__(self, time, power, bands, mel):
+
+        self.time = time
+        self.power = power
+        self.bands = bands
+        self.mel = mel
+
+
+class SpectralAnalyzer:
+
+    def __init__(self, rate=8192, windowSize=512, hop=256, bands=BANDS, melBands=24, \
+        minBatch=1, maxBatch=16):
+        ''' Creates an analyzer for audio sampled at rate Hz that transforms
+            Hann-weighted windows of windowSize samples every hop samples.
+            For each window it computes the power spectrum, the energy in each
+            (low, high) Hz band, and log mel energies in melBands bands.
+            Windows are transformed together once minBatch are ready, and at
+            most maxBatch at a time.
+        '''
+
+        self.rate = rate
+        self.windowSize = windowSize
+        self.hop = hop
+        self.minBatch = minBatch
+        self.maxBatch = maxBatch
+
+        self.frequencies = np.fft.rfftfreq(windowSize, 1. / rate)
+        self.bands = tuple(bands)
+
+        self.frames = 0
+
+        self._window = np.hanning(windowSize).astype(np.float32)
+        self._bandMatrix = band_matrix(rate, windowSize, self.bands).T.copy()
+        self._melMatrix = mel_filterbank(rate, windowSize, melBands).T.copy()
+
+        # Room for the largest batch of windows plus one packet's overflow
+        self._buffer = np.zeros(windowSize + (maxBatch+1)*hop + 4096, dtype=np.float32)
+        self._filled = 0
+        self._consumed = 0
+
+        self._listeners = ()
+
+    def subscribe(self, callback):
+        ''' Registers callback(frame) to be called with each SpectralFrame on
+            the thread that calls process().
+        '''
+        self._listeners = self._listeners + (callback,)
+
+    def unsubscribe(self, callback):
+        ''' Unregisters a callback added with subscribe().
+        '''
+        self._listeners = tuple(c for c in self._listeners if c != callback)
+
+    def attach(self, rover):
+        ''' Analyzes every block of audio the Rover delivers.
+        '''
+        rover.addAudioListener(self.process)
+
+    def detach(self, rover):
+        ''' Stops analyzing the Rover's audio.
+        '''
+        rover.removeAudioListener(self.process)
+
+    def process(self, pcmsamples):
+        ''' Adds a block of PCM samples and publishes the analysis of every
+            window completed, returning the list of SpectralFrames.
+        '''
+
+        samples = np.asarray(pcmsamples, dtype=np.float32)
+
+        frames = []
+
+        while len(samples):
+
+            room = len(self._buffer) - self._filled
+            count = min(room, len(samples))
+
+            self._buffer[self._filled:self._filled+count] = samples[:count]
+            self._filled += count
+            samples = samples[count:]
+
+            frames.extend(self._analyze(len(samples) > 0))
+
+        for frame in frames:
+            for callback in self._listeners:
+                callback(frame)
+
+        return frames
+
+    # "Private" methods ========================================================
+
+    def _analyze(self, full):
+
+        frames = []
+
+        # A fill may hold several batches; transform them all
+        while True:
+
+            ready = (self._filled - self.windowSize) // self.hop + 1 if self._filled >= self.windowSize else 0
+
+            # Wait for a full batch unless the buffer must be emptied
+            if not ready or (ready < self.minBatch and not full):
+                return frames
+
+            frames.extend(self._transform(min(ready, self.maxBatch)))
+
+    def _transform(self, count):
+
+        # View the buffer as overlapping windows without copying it
+        stride = self._buffer.strides[0]
+        windows = as_strided(self._buffer, (count, self.windowSize), (self.hop*stride, stride))
+
+        spectra = np.fft.rfft(windows * self._window, axis=1)
+        power = (spectra.real**2 + spectra.imag**2).astype(np.float32)
+
+        bands = np.dot(power, self._bandMatrix)
+        mel = np.log(np.dot(power, self._melMatrix) + 1e-6)
+
+        frames = []
+
+        for k in range(count):
+            center = self._consumed + k*self.hop + self.windowSize / 2.
+            frames.append(SpectralFrame(center / self.rate, power[k], bands[k], mel[k]))
+
+        # Keep the samples the next window still needs
+        used = count * self.hop
+        remaining = self._filled - used
+        self._buffer[:remaining] = self._buffer[used:self._filled]
+        self._filled = remaining
+        self._consumed += used
+
+        self.frames += count
+
+        return frames
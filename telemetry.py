@@ -0,0 +1,128 @@
+'''
+telemetry.py Background polling and caching of status readings, such as the
+battery level, from the Brookstone Rover 2.0.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+'''
+
+import threading
+
+from clock import monotonic
+
+
+class TelemetrySample:
+    ''' A status reading and the monotonic time it was taken.
+    '''
+
+    def __init__(self, value, time):
+
+        self.value = value
+        self.time = time
+
+    def age(self):
+        ''' Returns seconds since the reading was taken.
+        '''
+        return monotonic() - self.time
+
+
+class TelemetryPoller(threading.Thread):
+
+    def __init__(self, rover, intervalSec=30, ttlSec=None):
+        ''' Creates a daemon thread that re-reads each status query every
+            intervalSec seconds.  Readings older than ttlSec seconds (default:
+            three intervals) are treated as missing.  The Rover's battery
+            percentage is queried as 'battery'.
+        '''
+
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        self.rover = rover
+        self.intervalSec = intervalSec
+        self.ttlSec = 3*intervalSec if ttlSec is None else ttlSec
+
+        self.errors = 0
+
+        self._queries = {'battery' : rover.getBatteryPercentage}
+        self._samples = {}
+        self._listeners = ()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def addQuery(self, name, query):
+        ''' Adds a status reading, taken by calling query(), under the
+            specified name.
+        '''
+        self._queries[name] = query
+
+    def subscribe(self, callback):
+        ''' Registers callback(name, sample) to be called on the polling thread
+            whenever a reading changes value.
+        '''
+        self._listeners = self._listeners + (callback,)
+
+    def unsubscribe(self, callback):
+        ''' Unregisters a callback added with subscribe().
+        '''
+        self._listeners = tuple(c for c in self._listeners if c != callback)
+
+    def get(self, name):
+        ''' Returns the latest TelemetrySample for the named reading, or None
+            if there is none younger than the TTL.  Never touches the network.
+        '''
+
+        with self._lock:
+            sample = self._samples.get(name)
+
+        if sample is None or sample.age() > self.ttlSec:
+            return None
+
+        return sample
+
+    def value(self, name, default=None):
+        ''' Returns the cached value of the named reading, or default.
+        '''
+        sample = self.get(name)
+        return default if sample is None else sample.value
+
+    def refresh(self):
+        ''' Takes every reading now, on the calling thread.
+        '''
+
+        for name, query in list(self._queries.items()):
+
+            try:
+                value = query()
+
+            except Exception:
+                self.errors += 1
+                continue
+
+            sample = TelemetrySample(value, monotonic())
+
+            with self._lock:
+                previous = self._samples.get(name)
+                self._samples[name] = sample
+
+            if previous is None or previous.value != value:
+                for callback in self._listeners:
+                    callback(name, sample)
+
+    def stop(self):
+        ''' Stops polling.
+        '''
+        self._stopped.set()
+
+    def run(self):
+
+        while not self._stopped.is_set() and self.rover.is_active:
+            self.refresh()
+            self._stopped.wait(self.intervalSec)
@@ -0,0 +1,168 @@
+'''
+test_commandchannel.py Tests for the ordering of commands sent to the
+Brookstone Rover 2.0 by commandchannel.CommandChannel.
+
+Run with: python -m unittest test_commandchannel
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+'''
+
+import threading
+import unittest
+
+from commandchannel import CommandChannel, STOP, CONTROL, NORMAL
+from metrics import MetricsRegistry
+
+
+class _WireSocket:
+
+    def __init__(self):
+
+        self.sent = []
+
+        # Set to hold the channel in its next send until released
+        self.hold = None
+        self.holding = threading.Event()
+
+    def sendall(self, request):
+
+        hold = self.hold
+        if hold:
+            self.hold = None
+            self.holding.set()
+            hold.wait(5)
+
+        self.sent.append(request)
+
+
+class CommandOrderTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.sock = _WireSocket()
+        self.replyReady = threading.Event()
+        self.waitingForReply = threading.Event()
+
+        self.channel = CommandChannel(self.sock, self._receive, MetricsRegistry())
+        self.channel.start()
+
+    def tearDown(self):
+
+        self.replyReady.set()
+        self.channel.close(5)
+
+    def _holdNextSend(self):
+
+        release = threading.Event()
+        self.sock.hold = release
+        return release
+
+    def _receive(self, count):
+
+        # Hold the channel on the reply until the test lets it go
+        self.waitingForReply.set()
+        self.replyReady.wait(5)
+        return 'r' * count
+
+    def test_stop_replaces_queued_move_of_same_tread(self):
+
+        release = self._holdNextSend()
+        battery = self.channel.submit('battery', NORMAL, 32)
+        self.assertTrue(self.sock.holding.wait(5))
+
+        forward = self.channel.submit('left-forward-10', CONTROL, 0, 'left')
+        stop = self.channel.submit('left-stop', STOP, 0, 'left')
+
+        release.set()
+        self.replyReady.set()
+
+        for ticket in (battery, forward, stop):
+            self.assertTrue(ticket.wait(5))
+
+        self.assertEqual(self.sock.sent, ['battery', 'left-stop'])
+        self.assertTrue(forward.superseded)
+
+    def test_stop_leaves_other_tread_alone(self):
+
+        release = self._holdNextSend()
+        self.channel.submit('battery', NORMAL, 32)
+        self.assertTrue(self.sock.holding.wait(5))
+
+        right = self.channel.submit('right-forward-10', CONTROL, 0, 'right')
+        stop = self.channel.submit('left-stop', STOP, 0, 'left')
+
+        release.set()
+        self.replyReady.set()
+
+        for ticket in (right, stop):
+            self.assertTrue(ticket.wait(5))
+
+        self.assertEqual(self.sock.sent, ['battery', 'left-stop', 'right-forward-10'])
+
+    def test_move_already_sent_goes_before_stop(self):
+
+        forward = self.channel.submit('left-forward-10', CONTROL, 0, 'left')
+        self.assertTrue(forward.wait(5))
+
+        stop = self.channel.submit('left-stop', STOP, 0, 'left')
+        self.assertTrue(stop.wait(5))
+
+        self.assertEqual(self.sock.sent, ['left-forward-10', 'left-stop'])
+
+    def test_stop_not_held_up_by_pending_reply(self):
+
+        battery = self.channel.submit('battery', NORMAL, 32)
+        self.assertTrue(self.waitingForReply.wait(5))
+
+        stop = self.channel.submit('left-stop', STOP, 0, 'left')
+        self.assertTrue(stop.wait(5))
+
+        self.assertFalse(battery.isDone())
+        self.assertEqual(self.sock.sent, ['battery', 'left-stop'])
+
+        self.replyReady.set()
+        self.assertTrue(battery.wait(5))
+        self.assertEqual(battery.reply, 'r' * 32)
+
+
+class CommandCloseTest(unittest.TestCase):
+
+    def test_close_sends_commands_already_queued(self):
+
+        sock = _WireSocket()
+        release = threading.Event()
+        sock.hold = release
+
+        channel = CommandChannel(sock, lambda count: 'r' * count, MetricsRegistry())
+        channel.start()
+
+        tickets = [channel.submit('lights-on', NORMAL)]
+        self.assertTrue(sock.holding.wait(5))
+
+        tickets += [channel.submit('infrared-on', CONTROL), channel.submit('camera-up', CONTROL)]
+
+        closer = threading.Thread(target=channel.close, args=(5,))
+        closer.start()
+
+        release.set()
+        closer.join(5)
+
+        for ticket in tickets:
+            self.assertTrue(ticket.wait(5))
+            self.assertTrue(ticket.error is None)
+
+        self.assertEqual(sock.sent, ['lights-on', 'infrared-on', 'camera-up'])
+        self.assertFalse(channel.is_alive())
+        self.assertTrue(channel.submit('late').error is not None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+'''
+tracing.py Per-packet latency tracing for the Brookstone Rover 2.0, exported
+as Chrome / Perfetto trace JSON.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+'''
+
+import collections
+import json
+import os
+import threading
+
+
+class Tracer:
+
+    def __init__(self, capacity=100000):
+        ''' Creates a tracer keeping the last capacity events in a ring buffer.
+            Times passed in are seconds on the clock.py monotonic clock.
+        '''
+
+        self.capacity = capacity
+
+        self._events = collections.deque(maxlen=capacity)
+        self._threads = {}
+
+    def span(self, name, start, end, cat='media', args=None):
+        ''' Records a span from start to end on the calling thread.
+        '''
+        self._events.append(('X', name, cat, start, end-start, self._tid(), args))
+
+    def instant(self, name, when, cat='media', args=None):
+        ''' Records an instantaneous event on the calling thread.
+        '''
+        self._events.append(('i', name, cat, when, 0, self._tid(), args))
+
+    def clear(self):
+        ''' Discards all recorded events.
+        '''
+        self._events.clear()
+
+    def events(self):
+        ''' Returns the recorded events as a list of Chrome trace event
+            dictionaries, oldest first.
+        '''
+
+        pid = os.getpid()
+
+        events = [{'ph' : 'M', 'name' : 'thread_name', 'pid' : pid, 'tid' : tid,
+                   'args' : {'name' : name}} for tid, name in self._threads.items()]
+
+        for ph, name, cat, start, dur, tid, args in list(self._events):
+
+            event = {'ph' : ph, 'name' : name, 'cat' : cat, 'pid' : pid,
+                     'tid' : tid, 'ts' : start*1e6}
+
+            if ph == 'X':
+                event['dur'] = dur*1e6
+            else:
+                event['s'] = 't'
+
+            if args:
+                event['args'] = args
+
+            events.append(event)
+
+        return events
+
+    def dump(self, path):
+        ''' Writes the recorded events to path as Chrome trace JSON, which can
+            be loaded in chrome://tracing or ui.perfetto.dev.
+        '''
+
+        with open(path, 'w') as f:
+            json.dump({'traceEvents' : self.events(), 'displayTimeUnit' : 'ms'}, f)
+
+    def _tid(self):
+
+        thread = threading.current_thread()
+        tid = thread.ident
+
+        if tid not in self._threads:
+            self._threads[tid] = thread.name
+
+        return tid
@@ -0,0 +1,133 @@
+'''
+transport.py Socket profiles for the command and media connections to the
+Brookstone Rover 2.0.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+'''
+
+import socket
+
+# IP type-of-service value requesting low delay
+IPTOS_LOWDELAY = 0x10
+
+
+class TransportProfile:
+
+    def __init__(self, name, noDelay=False, rcvBuf=None, sndBuf=None, \
+        connectTimeout=5.0, readTimeout=None, keepAlive=True, keepIdleSec=10, \
+        keepIntervalSec=5, keepCount=3, lowDelay=False):
+        ''' Describes how to set up a socket: TCP_NODELAY, SO_RCVBUF/SO_SNDBUF
+            sizes in bytes (None keeps the OS default), connect and read
+            timeouts in seconds (None blocks forever), TCP keepalive probing,
+            and whether to request low-delay IP type of service.
+        '''
+
+        self.name = name
+        self.noDelay = noDelay
+        self.rcvBuf = rcvBuf
+        self.sndBuf = sndBuf
+        self.connectTimeout = connectTimeout
+        self.readTimeout = readTimeout
+        self.keepAlive = keepAlive
+        self.keepIdleSec = keepIdleSec
+        self.keepIntervalSec = keepIntervalSec
+        self.keepCount = keepCount
+        self.lowDelay = lowDelay
+
+
+# Small, latency-sensitive command traffic: never wait on Nagle
+CONTROL = TransportProfile('control', noDelay=True, connectTimeout=5.0, \
+    readTimeout=5.0, lowDelay=True)
+
+# Bulk video and audio: large receive buffer, short read timeout so the
+# media thread can notice a close
+MEDIA = TransportProfile('media', noDelay=True, rcvBuf=1048576, \
+    connectTimeout=5.0, readTimeout=1.0)
+
+PROFILES = {'control' : CONTROL, 'media' : MEDIA}
+
+
+def open_socket(host, port, profile):
+    '''
+    Returns a socket connected to (host, port) and set up according to the
+    TransportProfile, along with a dictionary of the settings in effect.
+    '''
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+    try:
+        # Buffer sizes must be set before connecting to affect window scaling
+        apply_profile(sock, profile)
+        sock.settimeout(profile.connectTimeout)
+        sock.connect((host, port))
+        sock.settimeout(profile.readTimeout)
+
+    except:
+        sock.close()
+        raise
+
+    return sock, effective_settings(sock, profile)
+
+
+def apply_profile(sock, profile):
+    '''
+    Sets the socket options of the TransportProfile on an unconnected socket.
+    Options the platform lacks are skipped.
+    '''
+
+    if profile.noDelay:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    if profile.rcvBuf:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, profile.rcvBuf)
+
+    if profile.sndBuf:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, profile.sndBuf)
+
+    if profile.lowDelay and hasattr(socket, 'IP_TOS'):
+        _trySetOption(sock, socket.IPPROTO_IP, socket.IP_TOS, IPTOS_LOWDELAY)
+
+    if profile.keepAlive:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        for option, value in (('TCP_KEEPIDLE', profile.keepIdleSec),
+                              ('TCP_KEEPINTVL', profile.keepIntervalSec),
+                              ('TCP_KEEPCNT', profile.keepCount)):
+            if hasattr(socket, option):
+                _trySetOption(sock, socket.IPPROTO_TCP, getattr(socket, option), value)
+
+
+def effective_settings(sock, profile):
+    '''
+    Returns a dictionary of the options actually in effect on the socket,
+    as reported by the OS.
+    '''
+
+    settings = {'profile' : profile.name,
+                'connect_timeout' : profile.connectTimeout,
+                'read_timeout' : sock.gettimeout(),
+                'nodelay' : bool(sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)),
+                'rcvbuf' : sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF),
+                'sndbuf' : sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF),
+                'keepalive' : bool(sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE))}
+
+    for option in ('TCP_KEEPIDLE', 'TCP_KEEPINTVL', 'TCP_KEEPCNT'):
+        if hasattr(socket, option):
+            settings[option.lower()] = sock.getsockopt(socket.IPPROTO_TCP, getattr(socket, option))
+
+    return settings
+
+
+def _trySetOption(sock, level, option, value):
+
+    try:
+        sock.setsockopt(level, option, value)
+    except socket.error:
+        pass